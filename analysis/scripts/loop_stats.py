@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+#Timing statistics of a periodic loop (timer callback, publishing loop, ...)
+#Call start() when an iteration begins and stop() when it ends; every report_interval seconds
+#the rate, the jitter (standard deviation of the period), the worst period, the mean and worst
+#duration of an iteration and the number of overruns (iterations longer than the period) are logged
+
+import time
+import numpy as np
+import utils
+
+
+class LoopStats():
+	def __init__(self,name,period=None,report_interval=10.,size=1000):
+		self.name=name
+		self.period=period
+		self.report_interval=report_interval
+		self.periods=np.zeros(size)
+		self.durations=np.zeros(size)
+		self.n_periods=0
+		self.n_durations=0
+		self.overruns=0
+		self.last_start=None
+		self.last_report=time.time()
+
+	def start(self):
+		now=time.time()
+		if self.last_start is not None:
+			self.periods[self.n_periods%len(self.periods)]=now-self.last_start
+			self.n_periods+=1
+		self.last_start=now
+
+	def stop(self):
+		now=time.time()
+		if self.last_start is None:
+			return
+		duration=now-self.last_start
+		self.durations[self.n_durations%len(self.durations)]=duration
+		self.n_durations+=1
+		if self.period is not None and duration>self.period:
+			self.overruns+=1
+		if self.report_interval and now-self.last_report>=self.report_interval:
+			self.report()
+			self.reset()
+			self.last_report=now
+
+	def get_stats(self):
+		#statistics of the iterations since the last report, times in seconds
+		periods=self.periods[:min(self.n_periods,len(self.periods))]
+		durations=self.durations[:min(self.n_durations,len(self.durations))]
+		stats={'iterations':self.n_durations,'overruns':self.overruns}
+		if len(periods):
+			stats['rate']=1./periods.mean()
+			stats['period_mean']=periods.mean()
+			stats['period_max']=periods.max()
+			stats['jitter']=periods.std()
+		if len(durations):
+			stats['duration_mean']=durations.mean()
+			stats['duration_max']=durations.max()
+		return stats
+
+	def report(self):
+		stats=self.get_stats()
+		if 'rate' not in stats or 'duration_mean' not in stats:
+			return
+		utils.loginfo('%s: %.1f Hz, jitter %.2f ms, worst period %.2f ms, duration %.2f ms (worst %.2f ms), %i overruns'%(
+			self.name,stats['rate'],stats['jitter']*1E3,stats['period_max']*1E3,
+			stats['duration_mean']*1E3,stats['duration_max']*1E3,stats['overruns']))
+
+	def reset(self):
+		self.n_periods=0
+		self.n_durations=0
+		self.overruns=0
+
+#EOF
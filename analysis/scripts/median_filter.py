@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+#Outlier rejection on streams of samples (velocities computed from the mocap positions for instance)
+#StreamingMedian keeps the median of the last `window` samples in two heaps, the lower half in a max-heap
+#and the upper half in a min-heap; a sample leaving the window is only marked as removed, and dropped once
+#it comes up to the top of its heap, so adding a sample costs O(log window)
+#MedianFilter runs one StreamingMedian per channel and replaces a sample by the median of the previous
+#ones when it is more than `threshold` times that median (or than min_median, so a drone at rest does
+#not reject every small velocity); the raw sample still enters the window, so a real change of the
+#signal is followed once it makes up half of the window
+
+import collections
+import heapq
+
+
+class StreamingMedian():
+	def __init__(self,window):
+		self.window=window
+		self.samples=collections.deque()
+		#lower half as negated values, upper half
+		self.low=[]
+		self.high=[]
+		#number of samples of each half still in the window
+		self.low_size=0
+		self.high_size=0
+		#samples left the window but still in a heap
+		self.removed=collections.defaultdict(int)
+
+	def __len__(self):
+		return len(self.samples)
+
+	def add(self,value):
+		self.samples.append(value)
+		if not self.low or value<=-self.low[0]:
+			heapq.heappush(self.low,-value)
+			self.low_size+=1
+		else:
+			heapq.heappush(self.high,value)
+			self.high_size+=1
+
+		if len(self.samples)>self.window:
+			oldest=self.samples.popleft()
+			self.removed[oldest]+=1
+			if oldest<=-self.low[0]:
+				self.low_size-=1
+				if oldest==-self.low[0]:
+					self.__prune(self.low,-1)
+			else:
+				self.high_size-=1
+				if oldest==self.high[0]:
+					self.__prune(self.high,1)
+		self.__balance()
+
+		#the removed samples buried in the heaps are only dropped when they come up, rebuild now and then
+		if len(self.low)+len(self.high)>4*self.window:
+			self.__rebuild()
+
+	def median(self):
+		if not self.samples:
+			return None
+		if self.low_size>self.high_size:
+			return -self.low[0]
+		return (-self.low[0]+self.high[0])/2.
+
+	def __prune(self,heap,sign):
+		#drop the removed samples on top of a heap
+		while heap and self.removed.get(sign*heap[0],0):
+			value=sign*heapq.heappop(heap)
+			self.removed[value]-=1
+			if not self.removed[value]:
+				del self.removed[value]
+
+	def __balance(self):
+		#the lower half has as many samples as the upper half, or one more
+		if self.low_size>self.high_size+1:
+			heapq.heappush(self.high,-heapq.heappop(self.low))
+			self.low_size-=1
+			self.high_size+=1
+			self.__prune(self.low,-1)
+		elif self.low_size<self.high_size:
+			heapq.heappush(self.low,-heapq.heappop(self.high))
+			self.low_size+=1
+			self.high_size-=1
+			self.__prune(self.high,1)
+
+	def __rebuild(self):
+		ordered=sorted(self.samples)
+		half=(len(ordered)+1)//2
+		self.low=[-value for value in ordered[0:half]]
+		self.high=ordered[half:]
+		heapq.heapify(self.low)
+		heapq.heapify(self.high)
+		self.low_size=len(self.low)
+		self.high_size=len(self.high)
+		self.removed.clear()
+
+
+class MedianFilter():
+	def __init__(self,channels,window=5,threshold=5.,min_median=0.5):
+		self.medians=[StreamingMedian(window) for i in range(0,channels)]
+		self.threshold=threshold
+		self.min_median=min_median
+		self.rejected=0
+
+	def filter(self,values):
+		#values of all the channels, with the outliers replaced by the median of the previous samples
+		result=[]
+		for value,median in zip(values,self.medians):
+			previous=median.median()
+			median.add(value)
+			if previous is not None and abs(value)>self.threshold*max(abs(previous),self.min_median):
+				self.rejected+=1
+				result.append(previous)
+			else:
+				result.append(value)
+		return result
+
+
+def test_median_filter():
+	#compare the running median with sorting the window, and time the filtering of a sample
+	import random
+	import time
+	for window in (1,2,5,30):
+		median=StreamingMedian(window)
+		samples=[]
+		for i in range(0,2000):
+			#repeated values as well
+			value=float(random.randint(-20,20)) if i%3 else random.gauss(0.,5.)
+			median.add(value)
+			samples.append(value)
+			last=sorted(samples[-window:])
+			half=len(last)//2
+			expected=last[half] if len(last)%2 else (last[half-1]+last[half])/2.
+			assert median.median()==expected
+
+	velocity_filter=MedianFilter(4)
+	for i in range(0,10):
+		velocity_filter.filter([1.,1.,0.,0.])
+	assert velocity_filter.filter([40.,1.,0.,3.])==[1.,1.,0.,0.]
+	assert velocity_filter.filter([1.1,1.2,0.1,0.])==[1.1,1.2,0.1,0.]
+	assert velocity_filter.rejected==2
+
+	velocity_filter=MedianFilter(4,window=30)
+	values=[[random.gauss(0.,1.) for k in range(0,4)] for i in range(0,10000)]
+	start=time.time()
+	for value in values:
+		velocity_filter.filter(value)
+	print('MedianFilter: %.1f us per sample of 4 channels, window 30'%((time.time()-start)*1E6/len(values)))
+
+
+if __name__=='__main__':
+	test_median_filter()
+
+#EOF
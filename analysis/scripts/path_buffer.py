@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+#Trajectory of a body for rviz, with a bounded cost however long the flight is:
+#only the last `capacity` poses are kept (ring buffer), a new pose is only kept once the
+#body has moved `min_distance` or `min_interval` seconds have passed since the last kept one,
+#and the Path is published at most `max_rate` times per second.
+#With segments=True only the poses kept since the last publication are sent (together with
+#the pose before them, so that the segments join up), for displays that accumulate them.
+
+import collections
+import itertools
+import rospy
+from nav_msgs.msg import Path
+
+
+class PathBuffer:
+	def __init__(self,publisher,frame_id='map',capacity=1000,min_distance=0.02,min_interval=1.0,max_rate=10.0,segments=False):
+		self.publisher=publisher
+		self.poses=collections.deque(maxlen=capacity)
+		self.path=Path()
+		self.path.header.frame_id=frame_id
+		self.min_distance=min_distance
+		self.min_interval=min_interval
+		self.max_rate=max_rate
+		self.segments=segments
+		self.last_kept=None
+		self.last_publish=None
+		self.pending=0
+
+	def add(self,pose_stamped,now=None):
+		#keep the pose if it is far enough, in space or in time, from the last kept one
+		if now is None:
+			now=rospy.get_time()
+		p=pose_stamped.pose.position
+		if self.last_kept is not None:
+			(x,y,z,t)=self.last_kept
+			distance2=(p.x-x)**2+(p.y-y)**2+(p.z-z)**2
+			if distance2<self.min_distance**2 and now-t<self.min_interval:
+				return False
+		self.last_kept=(p.x,p.y,p.z,now)
+		self.poses.append(pose_stamped)
+		self.pending+=1
+		return True
+
+	def publish(self,now=None):
+		#publish the path if a pose was kept since the last publication, at most max_rate times per second
+		if now is None:
+			now=rospy.get_time()
+		if not self.pending:
+			return False
+		if self.max_rate and self.last_publish is not None and now-self.last_publish<1.0/self.max_rate:
+			return False
+		if self.segments:
+			count=min(self.pending+1,len(self.poses))
+			self.path.poses=list(itertools.islice(self.poses,len(self.poses)-count,None))
+		else:
+			self.path.poses=list(self.poses)
+		self.path.header.stamp=rospy.get_rostime()
+		self.publisher.publish(self.path)
+		self.pending=0
+		self.last_publish=now
+		return True
+
+	def clear(self):
+		self.poses.clear()
+		self.last_kept=None
+		self.pending=0
+
+#EOF
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+#State of a quad, with the fields of mocap/QuadPositionDerived, held in one float64 array
+#The 19 numeric fields are stored in the message order (positions, velocities, accelerations, each
+#x,y,z,pitch,roll,yaw, then time_diff) and are read and written as attributes, like the message;
+#copying a message in or out is one call, and pos/vel/acc (x,y,z) and pose/twist/accel (x,y,z,yaw)
+#are arrays sharing the data, for the control math
+#Any object with these fields (QuadPositionDerived, QuadPosition, ...) can be read
+
+import operator
+import numpy as np
+
+#*************Constants*******************
+FIELDS=('x','y','z','pitch','roll','yaw',
+	'x_vel','y_vel','z_vel','pitch_vel','roll_vel','yaw_vel',
+	'x_acc','y_acc','z_acc','pitch_acc','roll_acc','yaw_acc',
+	'time_diff')
+POS_FIELDS=FIELDS[0:6]
+#indices of x,y,z,yaw of the positions, velocities and accelerations
+POSE=[0,1,2,5]
+TWIST=[6,7,8,11]
+ACCEL=[12,13,14,17]
+#*****************************************
+
+Get_Fields=operator.attrgetter(*FIELDS)
+Get_Pos_Fields=operator.attrgetter(*POS_FIELDS)
+
+
+def Field(index):
+	#attribute of a QuadState, a python float
+	def get(self):
+		return self.data.item(index)
+	def set(self,value):
+		self.data[index]=value
+	return property(get,set)
+
+
+class QuadState(object):
+	__slots__=('data','found_body','stamp','frame_number')
+
+	def __init__(self,data=None):
+		if data is None:
+			self.data=np.zeros(len(FIELDS))
+		else:
+			self.data=np.array(data,dtype=float)
+		self.found_body=True
+		self.stamp=None
+		self.frame_number=0
+
+	@classmethod
+	def from_msg(cls,msg):
+		state=cls()
+		state.update(msg)
+		return state
+
+	def update(self,msg):
+		#all the fields of a QuadPositionDerived message
+		self.data[:]=Get_Fields(msg)
+		self.found_body=msg.found_body
+		self.stamp=msg.header.stamp
+		self.frame_number=msg.frame_number
+
+	def update_pos(self,msg):
+		#positions and angles only, of a QuadPosition message for instance
+		self.data[0:6]=Get_Pos_Fields(msg)
+		self.found_body=msg.found_body
+
+	def to_msg(self,msg):
+		#fills msg (a QuadPositionDerived) and returns it
+		for name,value in zip(FIELDS,self.data.tolist()):
+			setattr(msg,name,value)
+		msg.found_body=self.found_body
+		if self.stamp is not None:
+			msg.header.stamp=self.stamp
+		msg.frame_number=self.frame_number
+		return msg
+
+	def copy(self):
+		state=QuadState(self.data)
+		state.found_body=self.found_body
+		state.stamp=self.stamp
+		state.frame_number=self.frame_number
+		return state
+
+	@property
+	def pos(self):
+		return self.data[0:3]
+
+	@property
+	def vel(self):
+		return self.data[6:9]
+
+	@property
+	def acc(self):
+		return self.data[12:15]
+
+	#x,y,z,yaw, copies
+	@property
+	def pose(self):
+		return self.data[POSE]
+
+	@property
+	def twist(self):
+		return self.data[TWIST]
+
+	@property
+	def accel(self):
+		return self.data[ACCEL]
+
+for index,name in enumerate(FIELDS):
+	setattr(QuadState,name,Field(index))
+
+
+def Stack(states):
+	#(N,19) array of N states
+	return np.array([state.data for state in states]).reshape(-1,len(FIELDS))
+
+
+def test_quad_state():
+	class Header():
+		def __init__(self):
+			self.stamp=0
+	class Msg():
+		def __init__(self):
+			self.header=Header()
+			self.found_body=False
+			self.frame_number=0
+			for name in FIELDS:
+				setattr(self,name,0.)
+
+	msg=Msg()
+	for i in range(0,len(FIELDS)):
+		setattr(msg,FIELDS[i],float(i))
+	msg.found_body=True
+	msg.header.stamp=12
+	msg.frame_number=3
+
+	state=QuadState.from_msg(msg)
+	assert state.yaw==5. and state.z_acc==14. and state.time_diff==18.
+	assert list(state.pose)==[0.,1.,2.,5.] and list(state.accel)==[12.,13.,14.,17.]
+	state.vel[:]=[1.,2.,3.]
+	assert state.x_vel==1. and state.z_vel==3.
+	state.yaw_vel=7.
+	assert list(state.twist)==[1.,2.,3.,7.]
+	try:
+		state.w=1.
+		assert False
+	except AttributeError:
+		pass
+
+	out=state.to_msg(Msg())
+	assert out.found_body and out.header.stamp==12 and out.frame_number==3
+	assert [getattr(out,name) for name in FIELDS]==state.data.tolist()
+	assert Stack([state,state.copy()]).shape==(2,len(FIELDS))
+	print('QuadState: all tests passed')
+
+
+if __name__=='__main__':
+	test_quad_state()
+
+#EOF
@@ -16,6 +16,7 @@ from controller.msg import Permission
 from std_srvs.srv import Empty
 import analysis
 import utils
+import quad_state
 
 
 #Constants
@@ -24,57 +25,23 @@ NODE_NAME='PID'
 #*************************************
 
 
-class Point():
+class Point(quad_state.QuadState):
+	#state of the quad (see quad_state.py), and whether a first message was received
+	__slots__=('first_point_received',)
+
 	def __init__(self):
-		self.found_body=True
-		self.x=0
-		self.y=0
-		self.z=0
-		self.yaw=0
-		self.pitch=0
-		self.roll=0
-		self.x_vel=0
-		self.y_vel=0
-		self.z_vel=0
-		self.yaw_vel=0
-		self.pitch_vel=0
-		self.roll_vel=0
-		self.x_acc=0
-		self.y_acc=0
-		self.z_acc=0
-		self.yaw_acc=0
-		self.pitch_acc=0
-		self.roll_acc=0
-		self.time_diff=0
+		quad_state.QuadState.__init__(self)
 		self.first_point_received=False
 
 	def update_point(self,new_data):
-		self.found_body=new_data.found_body
-		self.x=new_data.x
-		self.y=new_data.y
-		self.z=new_data.z
-		self.yaw=new_data.yaw
-		self.pitch=new_data.pitch
-		self.roll=new_data.roll
-		self.x_vel=new_data.x_vel
-		self.y_vel=new_data.y_vel
-		self.z_vel=new_data.z_vel
-		self.yaw_vel=new_data.yaw_vel
-		self.pitch_vel=new_data.pitch_vel
-		self.roll_vel=new_data.roll_vel
-		self.x_acc=new_data.x_acc
-		self.y_acc=new_data.y_acc
-		self.z_acc=new_data.z_acc
-		self.yaw_acc=new_data.yaw_acc
-		self.pitch_acc=new_data.pitch_acc
-		self.roll_acc=new_data.roll_acc
-		self.time_diff=new_data.time_diff
+		self.update(new_data)
 
 
 class Instruction():
 	def __init__(self):
 		self.start=False
 		self.permission=True
+		self.brake=False
 
 
 class PID():
@@ -3,18 +3,23 @@
 #PID controller for the IRIS+ in the SML Lab 
 #Gets inputs from the Security Guard and the Trajectory Generator
 #Publishes commands via Mavros' rc/override topic
+#With the event_driven parameter, the control law runs once per new state sample instead of at 30 Hz,
+#with the time between the samples, and a watchdog holds or lands the drone when the samples stop
 
 
 import rospy
 import sml_setup
 import sys
 import math
+import threading
 from controller.msg import PlotData
 from mavros.msg import OverrideRCIn
 from mocap.msg import QuadPositionDerived
 from controller.msg import Permission
 from obstacle_avoidance import AvoidanceController
 from PID_controller import Point, Instruction, PID
+import analysis
+import loop_stats
 
 
 
@@ -30,8 +35,7 @@ class Blender():
     body_id = sml_setup.Get_Parameter(NODE_NAME,'body_id',8)
     body_array = sml_setup.Get_Parameter(NODE_NAME,'body_array',[1,2])
     self.PID = PID()
-    self.avoidance = AvoidanceController(body_id,body_array)
-    rospy.init_node(NODE_NAME)
+    self.avoidance = AvoidanceController(body_id,body_array,sml_setup.Get_Parameter(NODE_NAME,"proximity_node",False))
     self.N_yaw = sml_setup.Get_Parameter(NODE_NAME,"PID_N_yaw",500)
     self.K_yaw = sml_setup.Get_Parameter(NODE_NAME,"PID_K_yaw",2)
     self.w_inf = sml_setup.Get_Parameter(NODE_NAME,"PID_w_inf",5)
@@ -43,6 +47,12 @@ class Blender():
     self.CONTROL_ARMING_MIN = sml_setup.Get_Parameter(NODE_NAME,"PID_CONTROL_ARMING_MIN",1025)
     self.CONTROL_CANCEL_GRAVITY = sml_setup.Get_Parameter(NODE_NAME,"PID_CONTROL_CANCEL_GRAVITY",1400)
     self.obstacle_avoidance = sml_setup.Get_Parameter(NODE_NAME,"obstacle_avoidance","False")
+    self.hold_point = None
+    self.event_driven = sml_setup.Get_Parameter(NODE_NAME,"event_driven",False)
+    #without a new sample for watchdog_timeout seconds, 'hold' (neutral sticks) or 'land'
+    self.watchdog_timeout = sml_setup.Get_Parameter(NODE_NAME,"watchdog_timeout",0.2)
+    self.watchdog_action = sml_setup.Get_Parameter(NODE_NAME,"watchdog_action","hold")
+    self.stats_interval = sml_setup.Get_Parameter(NODE_NAME,"loop_stats_interval",10.)
     
   def init_subscriptions(self, target_point,current_point, instr):
     #Subcribe to /trajectroy_gen/target to get target position, velocity and acceleration
@@ -51,6 +61,8 @@ class Blender():
     rospy.Subscriber('security_guard/data_forward',QuadPositionDerived,self.New_Point,current_point)
     #Subscribe to /security_guard/controller to get permission to publish to rc/override
     rospy.Subscriber('security_guard/controller',Permission,self.Get_Permission,instr)
+    #Subscribe to /security_guard/brake to hold the position when a boundary crossing is predicted
+    rospy.Subscriber('security_guard/brake',Permission,self.Get_Brake,instr)
 
   def Get_Permission(self,data,instruction_obj):
     if instruction_obj.permission:
@@ -61,6 +73,22 @@ class Blender():
       if data.permission:
         instruction_obj.start=True
 
+  def Get_Brake(self,data,instruction_obj):
+    #once the security guard brakes, the position is held until landing
+    if data.permission and not instruction_obj.brake:
+      rospy.logwarn('['+NODE_NAME+']: Braking, holding position')
+      instruction_obj.brake=True
+
+  def Get_Hold_Point(self,current_point):
+    #target at the current position, without velocity and acceleration
+    hold_point=Point()
+    hold_point.first_point_received=True
+    hold_point.x=current_point.x
+    hold_point.y=current_point.y
+    hold_point.z=current_point.z
+    hold_point.yaw=current_point.yaw
+    return hold_point
+
   def Wait_For_Security_Guard(self,obj):
     rate=rospy.Rate(30)
     rospy.loginfo('['+NODE_NAME+']: Waiting for security guard ...')
@@ -90,6 +118,7 @@ class Blender():
 
     #integral term initialized to 0
     self.PID.set_d_updated(0)
+    stats=loop_stats.LoopStats('blender',1./30,self.stats_interval)
     while not rospy.is_shutdown():
                 
 
@@ -97,11 +126,9 @@ class Blender():
 	self.Wait_For_First_Point(target_point,rc_override,data_init,loop_rate)
 	#reinitialize d_updated
 	self.PID.set_d_updated(0)
-      d = self.PID.get_d_updated()
-      x,x_vel,x_acc=self.PID.Get_Pos_Vel_Acc(current_point)  
-      x_target,x_vel_target,x_acc_target=self.PID.Get_Pos_Vel_Acc(target_point) 
-      u = self.blend(current_point, target_point,d)
-      command_controlled = self.get_controloutput(u,x,x_target)
+      stats.start()
+      command_controlled = self.Control_Step(current_point,target_point,instr)
+      stats.stop()
   
       #If OK from security guard, publish the messages via Mavros to the drone
       if instr.permission:
@@ -117,6 +144,109 @@ class Blender():
     
    
 
+  def Run_Blender_Event_Driven(self):
+    self.instr=Instruction()
+    self.current_point=Point()
+    self.target_point=Point()
+    self.rc_override=rospy.Publisher('mavros/rc/override',OverrideRCIn,queue_size=10)
+    self.lander_channel=rospy.Publisher('security_guard/lander',Permission,queue_size=10)
+    self.data_init=OverrideRCIn()
+    self.data_init.channels=[0,0,self.CONTROL_ARMING_MIN,0,0,0,0,0]
+    self.last_stamp=None
+    self.last_sample=None
+    self.watchdog_tripped=False
+    #the watchdog timer and the subscriber run in different threads
+    self.lock=threading.Lock()
+    self.landing=False
+    self.stats=loop_stats.LoopStats('blender',None,self.stats_interval)
+
+    rospy.Subscriber('trajectory_gen/target',QuadPositionDerived,self.New_Point,self.target_point)
+    rospy.Subscriber('security_guard/controller',Permission,self.Get_Permission,self.instr)
+    rospy.Subscriber('security_guard/brake',Permission,self.Get_Brake,self.instr)
+
+    #Wait until the security guard is online
+    self.Wait_For_Security_Guard(self.instr)
+
+    self.PID.set_d_updated(0)
+    #every state forwarded by the security guard triggers the control law
+    rospy.Subscriber('security_guard/data_forward',QuadPositionDerived,self.New_State)
+    rospy.Timer(rospy.Duration(self.watchdog_timeout/2.),self.Watchdog)
+    rospy.spin()
+
+  def Sample_Time(self,data):
+    #capture time of a sample, or its arrival time when it is not stamped
+    if data.header.stamp.is_zero():
+      return rospy.get_time()
+    return data.header.stamp.to_sec()
+
+  def New_State(self,data):
+    #serialised with Watchdog: both publish on rc_override and share watchdog_tripped and landing
+    with self.lock:
+      stamp=self.Sample_Time(data)
+      #a sample that is not newer than the last one brings nothing new
+      if self.last_stamp is not None and stamp<=self.last_stamp:
+        return
+      self.stats.start()
+      if self.last_stamp is None:
+        time_diff=0.
+      else:
+        time_diff=stamp-self.last_stamp
+      self.last_stamp=stamp
+      self.last_sample=rospy.get_time()
+      if self.watchdog_tripped and not self.landing:
+        rospy.loginfo('['+NODE_NAME+']: State samples are back')
+        self.watchdog_tripped=False
+
+      self.New_Point(data,self.current_point)
+      #the PID integrates over the real time between the samples
+      self.current_point.time_diff=time_diff
+
+      if not self.target_point.first_point_received:
+        #publish low value on the throttle channel, so the drone does not disarm while waiting
+        self.rc_override.publish(self.data_init)
+        self.PID.set_d_updated(0)
+      else:
+        command_controlled=self.Control_Step(self.current_point,self.target_point,self.instr)
+        if self.instr.permission and not self.landing:
+          data=OverrideRCIn()
+          data.channels=command_controlled
+          self.rc_override.publish(data)
+      self.stats.stop()
+
+  def Watchdog(self,event):
+    #the samples stopped: neutral sticks (the flight mode holds the altitude), or landing
+    with self.lock:
+      if self.last_sample is None or self.landing or not self.instr.permission:
+        return
+      if rospy.get_time()-self.last_sample<self.watchdog_timeout:
+        return
+      if not self.watchdog_tripped:
+        rospy.logwarn('['+NODE_NAME+']: No state sample for '+str(self.watchdog_timeout)+' s, '+self.watchdog_action)
+        self.watchdog_tripped=True
+      if self.watchdog_action=='land':
+        self.landing=True
+        permission=Permission()
+        permission.permission=True
+        self.lander_channel.publish(permission)
+      else:
+        data=OverrideRCIn()
+        data.channels=[self.CONTROL_NEUTRAL,self.CONTROL_NEUTRAL,self.CONTROL_NEUTRAL,self.CONTROL_NEUTRAL,0,0,0,0]
+        self.rc_override.publish(data)
+
+  def Control_Step(self,current_point,target_point,instr):
+    #one evaluation of the control law, returns the RC channels
+    if instr.brake:
+      if self.hold_point is None:
+        self.hold_point=self.Get_Hold_Point(current_point)
+      target=self.hold_point
+    else:
+      target=target_point
+    d = self.PID.get_d_updated()
+    x,x_vel,x_acc=self.PID.Get_Pos_Vel_Acc(current_point)  
+    x_target,x_vel_target,x_acc_target=self.PID.Get_Pos_Vel_Acc(target) 
+    u = self.blend(current_point, target,d)
+    return self.get_controloutput(u,x,x_target)
+
   def get_controloutput(self,u,x,x_target):
     AUX=[]
     AUX_rot=[]
@@ -206,7 +336,11 @@ class Blender():
   
 
 if __name__ == "__main__":
+  rospy.init_node(NODE_NAME)
   bl = Blender()
-  bl.Run_Blender()
+  if bl.event_driven:
+    bl.Run_Blender_Event_Driven()
+  else:
+    bl.Run_Blender()
 
 #EOF
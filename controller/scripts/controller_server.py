@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+#Controller of a whole fleet in one node, instead of one blender per drone
+#The PID law of PID_controller.PID and the attitude/throttle law of Blender.get_controloutput are
+#computed for all the vehicles at once, on (N,...) arrays of gains, integrator states and current/target
+#states, and all the RC overrides are published in the same tick
+#Every vehicle keeps its topics and parameters in its own namespace (the vehicles parameter):
+#<ns>/security_guard/data_forward, <ns>/trajectory_gen/target, <ns>/security_guard/controller,
+#<ns>/security_guard/brake and <ns>/mavros/rc/override, and the PID_* parameters of its blender
+#With obstacle_avoidance, the repulsion and blending constant of every vehicle come from the proximity node
+#The gains of a vehicle are reloaded by <ns>/PID_controller/update_parameters, like its blender's (see rqt_iris)
+#Started by scenarios/launch/controller_server.launch, with controller_server:=true for the iris_nodes.launch
+#of every vehicle, so that their blenders are not started
+
+### To check the batched law against PID and Blender, run "rosrun controller controller_server.py test"
+
+import rospy
+import sys
+import math
+import numpy as np
+import sml_setup
+from mavros.msg import OverrideRCIn
+from mocap.msg import QuadPositionDerived
+from controller.msg import Permission, Proximity
+from std_srvs.srv import Empty
+
+import analysis
+import utils
+import loop_stats
+
+#*************Constants*******************
+NODE_NAME='CS'
+#*****************************************
+
+
+def Load_Gains(namespace):
+	#gains of one vehicle, with the names and defaults of PID.load_PID_parameters and Blender.__init__
+	def get(name,default):
+		return sml_setup.Get_Parameter(NODE_NAME,namespace+'/'+name,default)
+	w=get('PID_w',1.7)
+	w_z=get('PID_w_z',1.3)
+	x_i=get('PID_x_i',math.sqrt(2)/2)
+	gains={}
+	gains['Kp']=get('PID_Kp',w*w)
+	gains['Kv']=get('PID_Kv',2*x_i*w)
+	gains['Kv_z']=get('PID_Kv_z',w_z*w_z)
+	gains['Kp_z']=get('PID_Kp_z',2*x_i*w_z)
+	gains['I_lim']=get('PID_I_lim',0.5)
+	gains['K_i']=get('PID_K_i',7)
+	gains['N_yaw']=get('PID_N_yaw',500)
+	gains['K_yaw']=get('PID_K_yaw',2)
+	gains['w_inf']=get('PID_w_inf',5)
+	gains['Ktt']=get('PID_Ktt',1000)/(20*math.pi/180)
+	gains['Kphi']=get('PID_Kphi',1000)/(20*math.pi/180)
+	gains['CONTROL_NEUTRAL']=get('PID_CONTROL_NEUTRAL',1500)
+	gains['CONTROL_ARMING_MIN']=get('PID_CONTROL_ARMING_MIN',1025)
+	gains['CONTROL_CANCEL_GRAVITY']=get('PID_CONTROL_CANCEL_GRAVITY',1400)
+	return gains
+
+
+def Stack_Gains(gains):
+	#one array per gain from a list of Load_Gains dicts
+	return dict((name,np.array([g[name] for g in gains],dtype=float)) for name in gains[0])
+
+
+def Get_Pos_Vel_Acc(states):
+	#(N,4) x,y,z,yaw positions, velocities and accelerations and (N,) time differences of N messages
+	data=np.array([(s.x,s.y,s.z,s.yaw,s.x_vel,s.y_vel,s.z_vel,s.yaw_vel,
+		s.x_acc,s.y_acc,s.z_acc,s.yaw_acc,s.time_diff) for s in states],dtype=float)
+	return data[:,0:4],data[:,4:8],data[:,8:12],data[:,12]
+
+
+def PID_Output(x,x_vel,x_acc,x_target,x_vel_target,x_acc_target,delta_t,d,g):
+	#PID.calculate_PID_output for N vehicles, returns the (N,3) commands and the new integrator states
+	e=x[:,0:3]-x_target[:,0:3]
+	e_dot=x_vel[:,0:3]-x_vel_target[:,0:3]
+
+	new_d=d+delta_t*(g['K_i']*((e[:,2]*g['Kv']/2)+e_dot[:,2]))
+	new_d=np.clip(new_d,-g['I_lim'],g['I_lim'])
+
+	u=np.empty((len(x),3))
+	u[:,0:2]=x_acc_target[:,0:2]-g['Kv'][:,np.newaxis]*e_dot[:,0:2]-g['Kp'][:,np.newaxis]*e[:,0:2]
+	u[:,2]=x_acc_target[:,2]-g['Kv_z']*e_dot[:,2]-g['Kp_z']*e[:,2]-new_d
+	return u,new_d
+
+
+def Control_Output(u,yaw,yaw_target,g):
+	#Blender.get_controloutput for N vehicles, returns the (N,8) RC channels
+	aux=u.copy()
+	aux[:,2]+=9.8
+
+	#take into consideration the yaw angle
+	c=np.cos(np.radians(-yaw))
+	s=np.sin(np.radians(-yaw))
+	aux_rot=np.column_stack((c*aux[:,0]-s*aux[:,1],s*aux[:,0]+c*aux[:,1],aux[:,2]))
+	norm_aux=np.sqrt((aux_rot*aux_rot).sum(axis=1))
+
+	#yaw control, with the angular difference in [-180,180]
+	diff=yaw-yaw_target
+	diff=np.where(np.abs(diff)>180,np.where(diff>0,diff-360,diff+360),diff)
+	w_yaw=-g['K_yaw']*np.radians(diff)
+
+	channels=np.zeros((len(u),8))
+	channels[:,2]=np.clip((g['CONTROL_CANCEL_GRAVITY']/9.8)*norm_aux,1000,2000)
+	channels[:,3]=g['CONTROL_NEUTRAL']-g['N_yaw']*np.clip(w_yaw/g['w_inf'],-1,1)
+	channels[:,1]=np.clip(g['CONTROL_NEUTRAL']-g['Ktt']*np.arcsin(aux_rot[:,0]/norm_aux),1350,1650)
+	channels[:,0]=np.clip(g['CONTROL_NEUTRAL']-g['Kphi']*np.arcsin(aux_rot[:,1]/norm_aux),1350,1650)
+	return channels
+
+
+class ControllerServer():
+	def __init__(self):
+		self.vehicles=sml_setup.Get_Parameter(NODE_NAME,'controller_server/vehicles',['iris1','iris2'])
+		self.obstacle_avoidance=sml_setup.Get_Parameter(NODE_NAME,'controller_server/obstacle_avoidance',False)
+		n=len(self.vehicles)
+		self.load_gains()
+		self.d=np.zeros(n)
+		#integral terms to reset with the first target, done in tick where they are updated
+		self.reset=np.zeros(n,dtype=bool)
+
+		#latest messages of every vehicle, written by the callbacks
+		self.current=[None]*n
+		self.target=[None]*n
+		self.start=np.zeros(n,dtype=bool)
+		self.permission=np.ones(n,dtype=bool)
+		self.brake=np.zeros(n,dtype=bool)
+		self.hold=np.zeros((n,4))
+		self.repulsion=np.zeros((n,3))
+		self.alpha=np.zeros(n)
+
+		self.rc_override=[]
+		for i in range(0,n):
+			ns='/'+self.vehicles[i]
+			self.rc_override.append(rospy.Publisher(ns+'/mavros/rc/override',OverrideRCIn,queue_size=10))
+			rospy.Subscriber(ns+'/security_guard/data_forward',QuadPositionDerived,self.new_current,i)
+			rospy.Subscriber(ns+'/trajectory_gen/target',QuadPositionDerived,self.new_target,i)
+			rospy.Subscriber(ns+'/security_guard/controller',Permission,self.get_permission,i)
+			rospy.Subscriber(ns+'/security_guard/brake',Permission,self.get_brake,i)
+			rospy.Service(ns+'/PID_controller/update_parameters',Empty,self.update_parameters)
+			if self.obstacle_avoidance:
+				body_id=sml_setup.Get_Parameter(NODE_NAME,ns+'/body_id',i+1)
+				rospy.Subscriber('/proximity/id_'+str(body_id),Proximity,self.get_proximity,i)
+
+		rospy.Service('controller_server/update_parameters',Empty,self.update_parameters)
+		rate=sml_setup.Get_Parameter(NODE_NAME,'controller_server/rate',30.)
+		interval=sml_setup.Get_Parameter(NODE_NAME,'controller_server/loop_stats_interval',10.)
+		self.stats=loop_stats.LoopStats('controller server',1./rate,interval)
+		rospy.Timer(rospy.Duration(1./rate),self.tick)
+
+	def load_gains(self):
+		self.gains=Stack_Gains([Load_Gains('/'+ns) for ns in self.vehicles])
+
+	def update_parameters(self,msg):
+		utils.loginfo('PID parameters loaded')
+		self.load_gains()
+		return []
+
+	def new_current(self,data,i):
+		self.current[i]=data
+
+	def new_target(self,data,i):
+		if self.target[i] is None:
+			#integral term initialized to 0 with the first point
+			self.reset[i]=True
+		self.target[i]=data
+
+	def get_permission(self,data,i):
+		if not data.permission:
+			self.permission[i]=False
+		if data.permission:
+			self.start[i]=True
+
+	def get_brake(self,data,i):
+		#once the security guard brakes, the position is held
+		if data.permission and not self.brake[i] and self.current[i] is not None:
+			utils.logwarn(self.vehicles[i]+': braking, holding position')
+			current=self.current[i]
+			self.hold[i]=(current.x,current.y,current.z,current.yaw)
+			self.brake[i]=True
+
+	def get_proximity(self,data,i):
+		self.repulsion[i]=data.repulsion
+		self.alpha[i]=data.alpha
+
+	def tick(self,event):
+		self.stats.start()
+		active=[i for i in range(0,len(self.vehicles)) if self.start[i] and self.permission[i] and self.current[i] is not None]
+		control=[i for i in active if self.target[i] is not None]
+
+		#low value on the throttle channel, so the drones waiting for their first point do not disarm
+		for i in active:
+			if self.target[i] is None:
+				data=OverrideRCIn()
+				data.channels=[0,0,int(self.gains['CONTROL_ARMING_MIN'][i]),0,0,0,0,0]
+				self.rc_override[i].publish(data)
+
+		if control:
+			index=np.array(control)
+			reset=index[self.reset[index]]
+			self.d[reset]=0.
+			self.reset[reset]=False
+			g=dict((name,value[index]) for name,value in self.gains.items())
+			x,x_vel,x_acc,delta_t=Get_Pos_Vel_Acc([self.current[i] for i in control])
+			x_target,x_vel_target,x_acc_target,unused=Get_Pos_Vel_Acc([self.target[i] for i in control])
+			braking=self.brake[index]
+			if braking.any():
+				x_target[braking]=self.hold[index[braking]]
+				x_vel_target[braking]=0.
+				x_acc_target[braking]=0.
+
+			u,self.d[index]=PID_Output(x,x_vel,x_acc,x_target,x_vel_target,x_acc_target,delta_t,self.d[index],g)
+			if self.obstacle_avoidance:
+				alpha=self.alpha[index][:,np.newaxis]
+				u[:,0:2]=alpha*self.repulsion[index,0:2]+(1-alpha)*u[:,0:2]
+			channels=Control_Output(u,x[:,3],x_target[:,3],g).tolist()
+
+			for k in range(0,len(control)):
+				data=OverrideRCIn()
+				data.channels=channels[k]
+				self.rc_override[control[k]].publish(data)
+		self.stats.stop()
+
+
+def test_controller_server():
+	#compare the batched law with PID.calculate_PID_output and Blender.get_controloutput, vehicle by vehicle
+	import time
+	from PID_controller import PID
+	from blender import Blender
+
+	class Vehicle(PID,Blender):
+		#the control law of a blender, with given gains instead of the parameter server
+		def __init__(self,gains):
+			for name in gains:
+				setattr(self,name,gains[name])
+			self.d_updated=0.
+
+	n=50
+	gains=[]
+	for i in range(0,n):
+		gains.append({'Kp':np.random.uniform(1,5),'Kv':np.random.uniform(1,5),'Kv_z':np.random.uniform(1,5),
+			'Kp_z':np.random.uniform(1,5),'I_lim':np.random.uniform(0.1,1),'K_i':np.random.uniform(1,10),
+			'N_yaw':500,'K_yaw':np.random.uniform(1,3),'w_inf':5,'Ktt':np.random.uniform(2000,4000),
+			'Kphi':np.random.uniform(2000,4000),'CONTROL_NEUTRAL':1500,'CONTROL_ARMING_MIN':1025,
+			'CONTROL_CANCEL_GRAVITY':np.random.uniform(1300,1500)})
+	g=Stack_Gains(gains)
+
+	def states():
+		state=np.random.uniform(-2,2,(n,4))
+		state[:,3]=np.random.uniform(-180,180,n)
+		return state
+	x,x_vel,x_acc=states(),states(),states()
+	x_target,x_vel_target,x_acc_target=states(),states(),states()
+	delta_t=np.random.uniform(0.01,0.05,n)
+	d=np.random.uniform(-0.5,0.5,n)
+
+	start=time.time()
+	u,new_d=PID_Output(x,x_vel,x_acc,x_target,x_vel_target,x_acc_target,delta_t,d,g)
+	channels=Control_Output(u,x[:,3],x_target[:,3],g)
+	elapsed=time.time()-start
+
+	for i in range(0,n):
+		vehicle=Vehicle(gains[i])
+		u_i=vehicle.calculate_PID_output(x[i],x_vel[i],x_acc[i],x_target[i],x_vel_target[i],x_acc_target[i],delta_t[i],d[i])
+		assert np.allclose(u_i,u[i]) and np.isclose(vehicle.get_d_updated(),new_d[i])
+		assert np.allclose(vehicle.get_controloutput(u_i,x[i],x_target[i]),channels[i])
+	print('ControllerServer: %d vehicles in %.3f ms, same commands as PID and Blender'%(n,elapsed*1E3))
+
+
+if __name__=='__main__':
+	if sys.argv[1:2]==['test']:
+		test_controller_server()
+	else:
+		rospy.init_node('controller_server')
+		server=ControllerServer()
+		rospy.spin()
+
+#EOF
@@ -5,36 +5,48 @@
 #Forwards the data to the controller
 
 import rospy
+import sml_setup
 from mocap.msg import QuadPositionDerived
 
+import analysis
+import quad_state
+import median_filter
 
-class Positioning():
-	def __init__(self):
-		self.x=0
-		self.y=0
-		self.z=0
-		self.yaw=0
-		self.x_vel=0
-		self.y_vel=0
-		self.z_vel=0
-		self.yaw_vel=0
-		self.x_acc=0
-		self.y_acc=0
-		self.z_acc=0
-		self.yaw_acc=0
+#*************Constants*******************
+NODE_NAME='DV'
+#*****************************************
+
+
+def Velocity_Filter(node_name):
+	#median filter on the x,y,z velocities, when the median_filter parameter is set
+	if not sml_setup.Get_Parameter(node_name,'median_filter',False):
+		return None
+	window=sml_setup.Get_Parameter(node_name,'median_filter_window',5)
+	threshold=sml_setup.Get_Parameter(node_name,'median_filter_threshold',5.)
+	min_median=sml_setup.Get_Parameter(node_name,'median_filter_min',0.5)
+	return median_filter.MedianFilter(3,window,threshold,min_median)
+
+
+class Positioning(quad_state.QuadState):
+	#derived state of the quad (see quad_state.py), and the previous positions and velocities
+	__slots__=('x_prev','y_prev','z_prev','yaw_prev','x_vel_prev','y_vel_prev','z_vel_prev','yaw_vel_prev',
+		'time','past_time','got_point','velocity_filter')
+
+	def __init__(self,velocity_filter=None):
+		quad_state.QuadState.__init__(self)
+		self.velocity_filter=velocity_filter
 
 		self.x_prev=0
-		self.v_prev=0
+		self.y_prev=0
 		self.z_prev=0
 		self.yaw_prev=0
 		self.x_vel_prev=0
-		self.v_vel_prev=0
+		self.y_vel_prev=0
 		self.z_vel_prev=0
 		self.yaw_vel_prev=0
 
 		self.time=rospy.Time.now()
 		self.past_time=rospy.Time.now()
-		self.time_diff=0
 
 		self.got_point=False
 
@@ -74,6 +86,11 @@ class Positioning():
 		self.yaw_vel=(yaw-self.yaw_prev)/time
 
 
+	def filter_vel(self):
+		#outliers of the velocities replaced by the median of the previous ones
+		if self.velocity_filter is not None:
+			(self.x_vel,self.y_vel,self.z_vel)=self.velocity_filter.filter((self.x_vel,self.y_vel,self.z_vel))
+
 	def set_acc(self,x_vel,y_vel,z_vel,yaw_vel,time):
 		self.x_acc=(x_vel-self.x_vel_prev)/time
 		self.y_acc=(y_vel-self.y_vel_prev)/time
@@ -82,33 +99,20 @@ class Positioning():
 
 
 
-def Derivation(data,quad_state):
-	quad_state.got_point=True
-	time=quad_state.time_difference()
+def Derivation(data,state):
+	state.got_point=True
+	state.found_body=data.found_body
+	time=state.time_difference()
 	
-	quad_state.set_pos(data.x,data.y,data.z,data.yaw)
-	quad_state.set_vel(quad_state.x,quad_state.y,quad_state.z,quad_state.yaw,time)
-	quad_state.set_acc(quad_state.x_vel,quad_state.y_vel,quad_state.z_vel,quad_state.yaw_vel,time)
-
+	state.set_pos(data.x,data.y,data.z,data.yaw)
+	state.set_vel(state.x,state.y,state.z,state.yaw,time)
+	state.filter_vel()
+	state.set_acc(state.x_vel,state.y_vel,state.z_vel,state.yaw_vel,time)
 
 
-def Get_Augmented_Data(quad_state):
-	data=QuadPositionDerived()
-	data.x=quad_state.x
-	data.y=quad_state.y
-	data.z=quad_state.z
-	data.yaw=quad_state.yaw
-	data.x_vel=quad_state.x_vel
-	data.y_vel=quad_state.y_vel
-	data.z_vel=quad_state.z_vel
-	data.yaw_vel=quad_state.yaw_vel
-	data.x_acc=quad_state.x_acc
-	data.y_acc=quad_state.y_acc
-	data.z_acc=quad_state.z_acc
-	data.yaw_acc=quad_state.yaw_acc
-	data.time_diff=quad_state.time_diff
 
-	return data
+def Get_Augmented_Data(state):
+	return state.to_msg(QuadPositionDerived())
 
 
 
@@ -116,7 +120,7 @@ if __name__=='__main__':
 	rospy.init_node('derivator')
 	loop_rate=rospy.Rate(30)
 
-	Quad_Pos=Positioning()
+	Quad_Pos=Positioning(Velocity_Filter(NODE_NAME))
 
 	#Subscribe to the forwarded data from the security guard
 	rospy.Subscriber('/security_guard/data_forward',QuadPositionDerived,Derivation,Quad_Pos)
@@ -5,36 +5,12 @@ import rospy
 from mocap.msg import QuadPositionDerived
 from controller.msg import PlotData
 
-
-class Point():
-	def __init__(self):
-		self.x=0
-		self.y=0
-		self.z=0
-		self.yaw=0
-		self.x_vel=0
-		self.y_vel=0
-		self.z_vel=0
-		self.yaw_vel=0
-		self.x_acc=0
-		self.y_acc=0
-		self.z_acc=0
-		self.yaw_acc=0
+import analysis
+import quad_state
 
 
 def New_Point(data,obj):
-	obj.x=data.x
-	obj.y=data.y
-	obj.z=data.z
-	obj.yaw=data.yaw
-	obj.x_vel=data.x_vel
-	obj.y_vel=data.y_vel
-	obj.z_vel=data.z_vel
-	obj.yaw_vel=data.yaw_vel
-	obj.x_acc=data.x_acc
-	obj.y_acc=data.y_acc
-	obj.z_acc=data.z_acc
-	obj.yaw_acc=data.yaw_acc
+	obj.update(data)
 	return
 
 
@@ -42,8 +18,8 @@ if __name__=='__main__':
 	rospy.init_node('error_vis')
 	loop_rate=rospy.Rate(30)
 
-	current_point=Point()
-	target_point=Point()
+	current_point=quad_state.QuadState()
+	target_point=quad_state.QuadState()
 
 	rospy.Subscriber('security_guard/data_forward',QuadPositionDerived,New_Point,current_point)
 	rospy.Subscriber('trajectory_gen/target',QuadPositionDerived,New_Point,target_point)
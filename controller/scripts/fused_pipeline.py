@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+#Security guard, derivator and blender run as stages of a single node
+#Every mocap frame of the body goes through the security check, the (optional) derivation and the
+#control law in the subscriber callback, which publishes the RC override itself, instead of hopping
+#through security_guard/data_forward and three 30 Hz loops
+#The stages are the functions of the security_guard, derivator and blender nodes, so they behave the
+#same and can be tested on their own; this node only chains them
+#A timer keeps checking the age of the data (the callback does not run when the frames stop) and keeps
+#publishing the landing permissions once the flight is interrupted
+
+import rospy
+import sml_setup
+import threading
+import security_guard
+import derivator
+from blender import Blender
+from PID_controller import Point, Instruction
+from mocap.msg import QuadPositionDerived
+from mavros.msg import OverrideRCIn
+from controller.msg import Permission
+
+import analysis
+import utils
+import loop_stats
+
+#*************Constants*******************
+NODE_NAME='FP'
+#*****************************************
+
+
+class FusedPipeline():
+	def __init__(self):
+		body_id=sml_setup.Get_Parameter(NODE_NAME,'body_id',8)
+
+		#security stage
+		self.guard_point=security_guard.Point()
+		self.boundaries=security_guard.Boundaries()
+		self.predictive=sml_setup.Get_Parameter(NODE_NAME,'predictive',False)
+		self.horizon=sml_setup.Get_Parameter(NODE_NAME,'prediction_horizon',1.0)
+		self.reaction_time=sml_setup.Get_Parameter(NODE_NAME,'reaction_time',0.3)
+		self.violation_action=sml_setup.Get_Parameter(NODE_NAME,'violation_action','land')
+		self.trajectory_done=security_guard.Trajectory()
+		self.interrupted=False
+
+		#derivation stage, for mocap data without velocities and accelerations (median_filter* parameters, see derivator.py)
+		self.derivation=sml_setup.Get_Parameter(NODE_NAME,'derivation',False)
+		self.quad_state=derivator.Positioning(derivator.Velocity_Filter(NODE_NAME))
+
+		#control stage
+		self.blender=Blender()
+		self.instr=Instruction()
+		self.instr.start=True
+		self.current_point=Point()
+		self.target_point=Point()
+		self.data_init=OverrideRCIn()
+		self.data_init.channels=[0,0,self.blender.CONTROL_ARMING_MIN,0,0,0,0,0]
+
+		self.lander_permission=Permission()
+		self.controller_permission=Permission()
+		self.controller_permission.permission=True
+		self.brake_permission=Permission()
+
+		self.lander_channel=rospy.Publisher('security_guard/lander',Permission,queue_size=10)
+		self.controller_channel=rospy.Publisher('security_guard/controller',Permission,queue_size=10)
+		self.brake_channel=rospy.Publisher('security_guard/brake',Permission,queue_size=10)
+		self.data_forward=rospy.Publisher('security_guard/data_forward',QuadPositionDerived,queue_size=10)
+		self.rc_override=rospy.Publisher('mavros/rc/override',OverrideRCIn,queue_size=10)
+		#the subscriber and the watchdog timer run in different threads
+		self.lock=threading.Lock()
+
+		#Timing of the whole pipeline in the callback, logged every loop_stats_interval seconds
+		self.stats=loop_stats.LoopStats('fused pipeline',None,sml_setup.Get_Parameter(NODE_NAME,'loop_stats_interval',10.))
+
+		self.blender.PID.set_d_updated(0)
+		rospy.Subscriber('trajectory_gen/target',QuadPositionDerived,self.blender.New_Point,self.target_point)
+		rospy.Subscriber('trajectory_gen/done',Permission,security_guard.Trajectory_Done,self.trajectory_done)
+		rospy.Subscriber('/body_data/id_'+str(body_id),QuadPositionDerived,self.new_frame)
+		rospy.Timer(rospy.Duration(1./30),self.watchdog)
+
+	def security_stage(self,data):
+		#security_guard: returns the state to forward, None if the flight has to be interrupted
+		security_guard.New_Point(data,self.guard_point)
+		if not security_guard.Security_Check(self.guard_point,self.boundaries.geofence) or self.trajectory_done.is_done:
+			return None
+		if self.predictive and not self.brake_permission.permission:
+			if security_guard.Boundary_Crossing_Expected(self.guard_point,self.boundaries.geofence,self.horizon,self.reaction_time):
+				if self.violation_action!='brake':
+					return None
+				utils.logerr('Braking, holding position')
+				self.brake_permission.permission=True
+				self.instr.brake=True
+		return security_guard.Get_Quad_State(self.guard_point)
+
+	def derivation_stage(self,data):
+		#derivator: velocities and accelerations from the positions
+		derivator.Derivation(data,self.quad_state)
+		derived=derivator.Get_Augmented_Data(self.quad_state)
+		derived.header=data.header
+		derived.found_body=data.found_body
+		return derived
+
+	def control_stage(self,data):
+		#blender: RC channels for the current state
+		self.blender.New_Point(data,self.current_point)
+		if not self.target_point.first_point_received:
+			#low value on the throttle channel, so the drone does not disarm while waiting for the trajectory
+			return self.data_init.channels
+		return self.blender.Control_Step(self.current_point,self.target_point,self.instr)
+
+	def new_frame(self,data):
+		#serialised with watchdog: both interrupt the flight and publish the permissions
+		with self.lock:
+			if self.interrupted:
+				return
+			self.stats.start()
+			forward=self.security_stage(data)
+			if forward is None:
+				self.interrupt()
+			else:
+				self.data_forward.publish(forward)
+				if self.derivation:
+					forward=self.derivation_stage(forward)
+				command=OverrideRCIn()
+				command.channels=self.control_stage(forward)
+				self.rc_override.publish(command)
+				self.publish_permissions()
+			self.stats.stop()
+
+	def interrupt(self):
+		if not self.interrupted:
+			utils.logerr('Initiate landing mode')
+		self.interrupted=True
+		self.instr.permission=False
+		self.lander_permission.permission=True
+		self.controller_permission.permission=False
+		self.publish_permissions()
+
+	def publish_permissions(self):
+		self.lander_channel.publish(self.lander_permission)
+		self.controller_channel.publish(self.controller_permission)
+		self.brake_channel.publish(self.brake_permission)
+
+	def watchdog(self,event):
+		#lost mocap signal or completed trajectory between the frames
+		with self.lock:
+			if not self.interrupted:
+				if self.trajectory_done.is_done or self.guard_point.get_time()>=0.5:
+					security_guard.Security_Check(self.guard_point,self.boundaries.geofence)
+					self.interrupt()
+			else:
+				self.publish_permissions()
+
+
+if __name__=='__main__':
+	rospy.init_node('fused_pipeline')
+	pipeline=FusedPipeline()
+	rospy.spin()
+
+#EOF
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+#Geofence of the security guard: the allowed region is the union of the allowed zones
+#minus the union of the keep-out zones (nets, pillars, payload rig, ...)
+#Zones are boxes, vertical cylinders, spheres and polygons extruded along z
+#Every zone gives the signed distance of many points at once (negative inside the zone),
+#and a uniform grid built once lists, for each cell, the zones that can be closer than
+#max_distance to it, so a query only evaluates the zones around the bodies
+#Distances are exact up to max_distance and clamped to it beyond
+
+import math
+import rospy
+import numpy as np
+
+#************Constants********************
+#Lowest z of the legacy cube and cylinder, which had no lower bound
+FLOOR=-10.
+#Side of the grid cells [m]
+CELL_SIZE=0.5
+#Distances beyond this [m] are reported as this
+MAX_DISTANCE=2.
+#The grid is coarsened until it has at most this many cells
+MAX_CELLS=100000
+#*****************************************
+
+
+def Extrude(distance_xy,z,zmin,zmax):
+	#signed distance of a shape extruded between zmin and zmax, from the signed distance of its section
+	distance_z=np.abs(z-0.5*(zmin+zmax))-0.5*(zmax-zmin)
+	outside=np.hypot(np.maximum(distance_xy,0.),np.maximum(distance_z,0.))
+	inside=np.minimum(np.maximum(distance_xy,distance_z),0.)
+	return outside+inside
+
+
+class Box():
+	def __init__(self,minimum,maximum,keepout=False):
+		self.minimum=np.array(minimum,dtype=float)
+		self.maximum=np.array(maximum,dtype=float)
+		self.keepout=keepout
+
+	def bounds(self):
+		return self.minimum,self.maximum
+
+	def distance(self,points):
+		q=np.abs(points-0.5*(self.minimum+self.maximum))-0.5*(self.maximum-self.minimum)
+		outside=np.sqrt((np.maximum(q,0.)**2).sum(axis=1))
+		inside=np.minimum(q.max(axis=1),0.)
+		return outside+inside
+
+
+class Cylinder():
+	#vertical cylinder
+	def __init__(self,center,radius,zmin,zmax,keepout=False):
+		self.center=np.array(center,dtype=float)
+		self.radius=float(radius)
+		self.zmin=float(zmin)
+		self.zmax=float(zmax)
+		self.keepout=keepout
+
+	def bounds(self):
+		return (np.array([self.center[0]-self.radius,self.center[1]-self.radius,self.zmin]),
+			np.array([self.center[0]+self.radius,self.center[1]+self.radius,self.zmax]))
+
+	def distance(self,points):
+		distance_xy=np.hypot(points[:,0]-self.center[0],points[:,1]-self.center[1])-self.radius
+		return Extrude(distance_xy,points[:,2],self.zmin,self.zmax)
+
+
+class Sphere():
+	def __init__(self,center,radius,keepout=False):
+		self.center=np.array(center,dtype=float)
+		self.radius=float(radius)
+		self.keepout=keepout
+
+	def bounds(self):
+		return self.center-self.radius,self.center+self.radius
+
+	def distance(self,points):
+		return np.sqrt(((points-self.center)**2).sum(axis=1))-self.radius
+
+
+class ExtrudedPolygon():
+	#polygon in the xy plane (list of vertices, in any order of rotation) between zmin and zmax
+	def __init__(self,vertices,zmin,zmax,keepout=False):
+		self.vertices=np.array(vertices,dtype=float)
+		self.edges=np.roll(self.vertices,-1,axis=0)-self.vertices
+		self.edges_length2=(self.edges**2).sum(axis=1)
+		self.zmin=float(zmin)
+		self.zmax=float(zmax)
+		self.keepout=keepout
+
+	def bounds(self):
+		return (np.append(self.vertices.min(axis=0),self.zmin),
+			np.append(self.vertices.max(axis=0),self.zmax))
+
+	def distance(self,points):
+		#w: (N,M,2) vectors from the M vertices to the N points
+		w=points[:,np.newaxis,:2]-self.vertices[np.newaxis,:,:]
+		t=np.clip((w*self.edges).sum(axis=2)/self.edges_length2,0.,1.)
+		closest=w-self.edges*t[:,:,np.newaxis]
+		distance_xy=np.sqrt((closest**2).sum(axis=2).min(axis=1))
+
+		#even-odd rule: a point is inside if a ray along +x crosses an odd number of edges
+		y=points[:,1,np.newaxis]
+		y0=self.vertices[:,1]
+		y1=y0+self.edges[:,1]
+		straddle=(y0>y)!=(y1>y)
+		with np.errstate(divide='ignore',invalid='ignore'):
+			crossing_x=self.vertices[:,0]+self.edges[:,0]*(y-y0)/self.edges[:,1]
+		crossings=(straddle&(points[:,0,np.newaxis]<crossing_x)).sum(axis=1)
+		distance_xy[crossings%2==1]*=-1.
+		return Extrude(distance_xy,points[:,2],self.zmin,self.zmax)
+
+
+class Geofence():
+	#Allowed region made of zones, with a uniform grid of the zones near each cell
+	#Built once and never modified: load a new Geofence to change it
+	def __init__(self,zones,cell_size=CELL_SIZE,max_distance=MAX_DISTANCE):
+		self.zones=list(zones)
+		self.max_distance=float(max_distance)
+		self.keepout=np.array([zone.keepout for zone in self.zones],dtype=bool)
+		if not (~self.keepout).any():
+			raise ValueError('The geofence needs at least one allowed zone')
+
+		#grid covering all the zones and max_distance around them
+		bounds=np.array([zone.bounds() for zone in self.zones])
+		self.origin=bounds[:,0].min(axis=0)-self.max_distance
+		extent=bounds[:,1].max(axis=0)+self.max_distance-self.origin
+		cell_size=float(cell_size)
+		while np.prod(np.ceil(extent/cell_size))>MAX_CELLS:
+			cell_size*=2.
+		self.cell_size=cell_size
+		self.shape=np.ceil(extent/cell_size).astype(int)
+
+		#zones whose bounding box is closer than max_distance to each cell
+		cells=np.indices(self.shape).reshape(3,-1).T
+		cell_min=self.origin+cells*cell_size-self.max_distance
+		cell_max=cell_min+cell_size+2.*self.max_distance
+		self.cell_zones=((cell_min[:,np.newaxis,:]<=bounds[np.newaxis,:,1])&
+			(cell_max[:,np.newaxis,:]>=bounds[np.newaxis,:,0])).all(axis=2)
+
+	def __str__(self):
+		return '%i allowed zones, %i keep-out zones, %s grid of %.2f m cells'%(
+			(~self.keepout).sum(),self.keepout.sum(),'x'.join(str(n) for n in self.shape),self.cell_size)
+
+	def signed_distance(self,points):
+		#(N,) signed distance of (N,3) points to the boundary of the allowed region, negative inside
+		points=np.atleast_2d(np.asarray(points,dtype=float))
+		cells=np.floor((points-self.origin)/self.cell_size).astype(int)
+		in_grid=((cells>=0)&(cells<self.shape)).all(axis=1)
+		candidates=np.zeros((len(points),len(self.zones)),dtype=bool)
+		if in_grid.any():
+			candidates[in_grid]=self.cell_zones[np.ravel_multi_index(cells[in_grid].T,self.shape)]
+
+		#zones that are not candidates are further than max_distance
+		distances=np.empty((len(points),len(self.zones)))
+		distances.fill(self.max_distance)
+		for i in np.flatnonzero(candidates.any(axis=0)):
+			near=candidates[:,i]
+			distances[near,i]=self.zones[i].distance(points[near])
+		distances=np.minimum(distances,self.max_distance)
+
+		allowed=distances[:,~self.keepout].min(axis=1)
+		if self.keepout.any():
+			keepout=distances[:,self.keepout].min(axis=1)
+			allowed=np.maximum(allowed,-keepout)
+		return np.clip(allowed,-self.max_distance,self.max_distance)
+
+	def check(self,points):
+		#(N,) inside flags and (N,) distances to the nearest boundary of (N,3) points
+		distance=self.signed_distance(points)
+		return distance<=0.,np.abs(distance)
+
+	def time_to_violation(self,positions,velocities,accelerations,horizon,steps=20):
+		#(N,) time [s] until (N,3) bodies keeping their velocity and acceleration leave the allowed region,
+		#from steps+1 instants over horizon seconds, interpolated between the last one inside and the first
+		#one outside; 0 for bodies already outside, inf for bodies that stay inside over the horizon
+		p=np.atleast_2d(np.asarray(positions,dtype=float))
+		v=np.atleast_2d(np.asarray(velocities,dtype=float))
+		a=np.atleast_2d(np.asarray(accelerations,dtype=float))
+		t=np.linspace(0.,horizon,steps+1)
+		trajectory=(p[:,np.newaxis,:]+v[:,np.newaxis,:]*t[np.newaxis,:,np.newaxis]+
+			0.5*a[:,np.newaxis,:]*(t*t)[np.newaxis,:,np.newaxis])
+		distance=self.signed_distance(trajectory.reshape(-1,3)).reshape(len(p),len(t))
+
+		outside=distance>0.
+		first=outside.argmax(axis=1)
+		result=np.empty(len(p))
+		result.fill(np.inf)
+		result[outside[:,0]]=0.
+		crossing=outside.any(axis=1)&~outside[:,0]
+		if crossing.any():
+			i=np.flatnonzero(crossing)
+			k=first[i]
+			before=distance[i,k-1]
+			after=distance[i,k]
+			result[i]=t[k-1]+(t[k]-t[k-1])*(-before)/(after-before)
+		return result
+
+
+def Zone_From_Dict(zone):
+	#zone described in the parameters, e.g. {type: cylinder, center: [1,1], radius: 0.3, zmin: 0, zmax: 3, keepout: true}
+	keepout=bool(zone.get('keepout',False))
+	shape=zone.get('type')
+	if shape == 'box':
+		return Box(zone['min'],zone['max'],keepout)
+	if shape == 'cylinder':
+		return Cylinder(zone['center'],zone['radius'],zone.get('zmin',FLOOR),zone['zmax'],keepout)
+	if shape == 'sphere':
+		return Sphere(zone['center'],zone['radius'],keepout)
+	if shape == 'polygon':
+		return ExtrudedPolygon(zone['vertices'],zone.get('zmin',FLOOR),zone['zmax'],keepout)
+	raise ValueError('Unknown geofence zone type: '+str(shape))
+
+
+def Legacy_Zones(shape,centerx,centery,side,radius,height):
+	#single zone of the former shape/centerx/centery/side/radius/height parameters
+	if shape == 'cube':
+		return [Box([centerx-side/2,centery-side/2,FLOOR],[centerx+side/2,centery+side/2,side])]
+	if shape == 'hemisphere':
+		return [Sphere([centerx,centery,0.],radius)]
+	if shape == 'cylinder':
+		return [Cylinder([centerx,centery],radius,FLOOR,height)]
+	raise ValueError('Unknown geofence shape: '+str(shape))
+
+
+def Load_Geofence(namespace='security_guard'):
+	#zones from the <namespace>/zones parameter, or from the legacy single shape parameters
+	if rospy.has_param(namespace+'/zones'):
+		zones=[Zone_From_Dict(zone) for zone in rospy.get_param(namespace+'/zones')]
+	else:
+		zones=Legacy_Zones(rospy.get_param(namespace+'/shape','cube'),
+			float(rospy.get_param(namespace+'/centerx',0.0)),
+			float(rospy.get_param(namespace+'/centery',0.0)),
+			float(rospy.get_param(namespace+'/side',4.0)),
+			float(rospy.get_param(namespace+'/radius',0)),
+			float(rospy.get_param(namespace+'/height',0)))
+	return Geofence(zones,
+		float(rospy.get_param(namespace+'/cell_size',CELL_SIZE)),
+		float(rospy.get_param(namespace+'/max_distance',MAX_DISTANCE)))
+
+
+def test_geofence():
+	#compare the grid against all the zones evaluated everywhere, and time a query
+	import time
+	zones=[Box([-3,-2,0],[3,2,3]),
+		Cylinder([4,0],1.5,0,2.5),
+		Sphere([0,0,3],1.),
+		Cylinder([1,1],0.2,0,3,keepout=True),
+		ExtrudedPolygon([[-2,-1],[-1,-1],[-1.5,0]],0,3,keepout=True),
+		Box([2,-2,0],[2.5,-1.5,1],keepout=True)]
+	fence=Geofence(zones)
+	points=np.random.uniform([-6,-4,-1],[7,4,5],(10000,3))
+	allowed=np.min([zone.distance(points) for zone in zones if not zone.keepout],axis=0)
+	keepout=np.min([zone.distance(points) for zone in zones if zone.keepout],axis=0)
+	expected=np.clip(np.maximum(allowed,-keepout),-fence.max_distance,fence.max_distance)
+	assert np.allclose(fence.signed_distance(points),expected)
+
+	#points exactly on the zones
+	inside,distance=fence.check([[0,0,1],[1,1,1],[-1.5,-0.8,1],[4,0,2],[0,0,3.9],[10,10,10]])
+	assert inside.tolist()==[True,False,False,True,True,False]
+	assert abs(distance[0]-1.)<1E-9 and distance[-1]==fence.max_distance
+
+	#the legacy cube
+	fence=Geofence(Legacy_Zones('cube',0.,0.,4.,0.,0.))
+	inside,distance=fence.check([[1.9,0,1],[2.1,0,1],[0,0,4.5]])
+	assert inside.tolist()==[True,False,False]
+
+	#towards the side of the legacy cube at 2 m/s and 1 m/s^2, hovering inside and outside
+	times=fence.time_to_violation([[0,0,1],[1,0,1],[3,0,1]],[[2,0,0],[0,0,0],[0,0,0]],[[1,0,0],[0,0,0],[0,0,0]],2.)
+	assert abs(times[0]-(math.sqrt(8)-2))<0.01 and times[1]==np.inf and times[2]==0.
+
+	fence=Geofence(zones)
+	bodies=np.random.uniform([-3,-2,0],[3,2,3],(10,3))
+	start=time.time()
+	for i in range(1000):
+		fence.check(bodies)
+	print('%s: %.1f us for 10 bodies'%(fence,(time.time()-start)*1E3))
+
+
+if __name__=='__main__':
+	test_geofence()
+
+#EOF
@@ -12,6 +12,8 @@ from mocap.srv import BodyData
 import sys
 import math
 import sml_setup
+import analysis
+import median_filter
 
 
 #Constants
@@ -33,6 +35,9 @@ YAW_ANGLE=0
 
 #Discard value that are x times higher than the median of the previous measures
 MEDIAN_FILTER_THRESHOLD=5
+#number of previous measures, and median below which the threshold applies to this value instead [m/s]
+MEDIAN_FILTER_WINDOW=5
+MEDIAN_FILTER_MIN=0.5
 
 #Controller parameters
 Ktt=1000/(20*math.pi/180)
@@ -62,7 +67,7 @@ def Control_To_RC(channel):
 	return
 
 
-def Get_Current_State(body,body_prev,time):
+def Get_Current_State(body,body_prev,time,velocity_filter):
 	#Get the current position and velocity of the quad
 
 	x1=body.pos.x
@@ -80,8 +85,8 @@ def Get_Current_State(body,body_prev,time):
 	v3=delta_x3/time
 	v4=delta_x4/time
 
-	#Add a filter on the velocity to cancel out numerical spikes
-	#(v1,v2,v3,v4)=MedianFilter(??)
+	#Add a filter on the velocity to cancel out numerical spikes (the yaw rate is not used by Hovering)
+	(v1,v2,v3)=velocity_filter.filter((v1,v2,v3))
 
 	return (x1,x2,x3,x4),(v1,v2,v3,v4)
 
@@ -168,7 +173,7 @@ if __name__=='__main__':
 	plot_pos_z=rospy.Publisher('/controller/plot_data_z',PlotData,queue_size=10)
 
 	#Set up service to request body data from Qualysis
-	body_info=sml_setup.Connect_To_Mocap(NODE_NAME)
+	body_info=sml_setup.Connect_To_Mocap(NODE_NAME,persistent=True)
 
 	data=OverrideRCIn()
 	command=[0,0,0,CONTROL_ARMING_MIN,0,0,0,0]
@@ -197,6 +202,8 @@ if __name__=='__main__':
 
 	d_updated=0
 
+	velocity_filter=median_filter.MedianFilter(3,MEDIAN_FILTER_WINDOW,MEDIAN_FILTER_THRESHOLD,MEDIAN_FILTER_MIN)
+
 	while not rospy.is_shutdown():
 
 		#Get coordinates from Qualysis
@@ -215,7 +222,7 @@ if __name__=='__main__':
 		time_diff=delta_time.secs+(delta_time.nsecs/1E9)
 
 		#compute current position and velocity
-		x,v=Get_Current_State(body,body_prev,time_diff)
+		x,v=Get_Current_State(body,body_prev,time_diff,velocity_filter)
 
 		#implement the controller
 		command_controlled,d_updated=Hovering(x,v,x_target,time_diff,d_updated)
@@ -6,7 +6,9 @@
 import rospy
 import sml_setup
 from mocap.msg import QuadPositionDerived
+from controller.msg import QuadStateSimple
 from controller.srv import BodyDataDerived
+from derivator import Velocity_Filter
 
 #**********Constants*************
 NODE_NAME="MD"
@@ -52,8 +54,13 @@ def Callback(input_data):
 	except:
 		return False, QuadPositionDerived()
 
-	pos_now=QuadPositionDerived(body.pos.x,body.pos.y,body.pos.z,body.pos.yaw)
+	pos_now=QuadStateSimple(x=body.pos.x,y=body.pos.y,z=body.pos.z,yaw=body.pos.yaw)
 	vel_now=Derive(pos_now,pos_previous,delta_t)
+	if use_velocity_filter:
+		#one filter per body, created with the first request for it
+		if body_id not in velocity_filters:
+			velocity_filters[body_id]=Velocity_Filter(NODE_NAME)
+		(vel_now.x,vel_now.y,vel_now.z)=velocity_filters[body_id].filter((vel_now.x,vel_now.y,vel_now.z))
 	acc_now=Derive(vel_now,vel_previous,delta_t)
 
 	State=MakeQuadState(pos_now,vel_now,acc_now,delta_t)
@@ -67,6 +74,10 @@ if __name__=='__main__':
 
 	body_info=sml_setup.Connect_To_Mocap(NODE_NAME)
 
+	#median filter on the velocities, median_filter* parameters (see derivator.py)
+	use_velocity_filter=sml_setup.Get_Parameter(NODE_NAME,'median_filter',False)
+	velocity_filters={}
+
 	Mocap_Derivator=rospy.Service("mocap_get_data_derived",BodyDataDerived,Callback)
 
 	while not rospy.is_shutdown():
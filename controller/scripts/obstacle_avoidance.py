@@ -4,91 +4,118 @@ import sys
 import ast
 import math
 import numpy
-import trajectory_generator
-from trajectory_generato import TrajectoryGenerator
-from mocap.msg import QuadPositionDerived
+from mocap.msg import QuadPositionDerivedArray
+from controller.msg import Proximity
+
+GAIN = 2.                     #x,y direction
+GAIN_Z = 0.                   #z direction
+ALPHA_MAX = 0.8               # <= 1.
+ALPHA_MIN = 0.                # >=0.
+R_MIN = 1.2
+R_MAX = 2.
+
+
+def Potential(distances,directions,gain=GAIN,gain_z=GAIN_Z):
+  #repulsion of the other bodies, from their (M,) distances and (M,3) unit directions away from them, saturated under 0.1 m
+  weights = 1./numpy.maximum(distances,0.1)
+  u_xy = gain*numpy.dot(weights,directions[:,0:2])
+  u_z = gain_z*numpy.dot(weights,directions[:,2])
+  return [u_xy[0], u_xy[1], u_z]
+
+
+def Blending_Constant(distances,gain=GAIN):
+  #weight of the avoidance against the PID, from the distance of the closest body
+  k = (ALPHA_MIN - ALPHA_MAX)/(R_MAX - R_MIN)
+  m = ALPHA_MAX - k * R_MIN
+  if gain == 0 or len(distances) == 0:
+    return 0
+  closest = distances.min()
+  if closest <= R_MIN:
+    return ALPHA_MAX
+  elif closest > R_MAX:
+     return ALPHA_MIN
+  else:
+    return (k*closest + m)
+
 
 class AvoidanceController():
   
   
  
-  def __init__(self,my_id,bodies):
-    self.gain = 2.                    #x,y direction
-    self.gain_z = 0.		      #z direction
-    self.tg = TrajectoryGenerator()
+  def __init__(self,my_id,bodies,proximity=False):
+    self.gain = GAIN
+    self.gain_z = GAIN_Z
     self.my_id = my_id
     self.bodies = bodies
-    self.states = []
+    self.indices = {}
     for i in range(0,len(self.bodies)):   
-      self.states.append(QuadPositionDerived())
-      rospy.Subscriber("/body_data/id_"+str(self.bodies[i]),QuadPositionDerived, self.__set_states)
+      self.indices[self.bodies[i]] = i
+    #positions of all the bodies as one (N,3) block, replaced (not modified) at every mocap frame
+    self.positions = numpy.zeros((len(self.bodies),3))
+    self.my_index = self.indices.get(my_id)
+    if self.my_index is None:
+      rospy.logerr('[AvoidanceController]: body '+str(my_id)+' is not in the body array')
+      self.others = numpy.zeros(0,dtype=int)
+    else:
+      self.others = numpy.array([i for i in range(0,len(self.bodies)) if i != self.my_index],dtype=int)
+    self.neighbours_positions = None
+    self.neighbours = None
+    #with proximity, the repulsion and the blending constant come from the proximity node
+    #(computed there once for the whole swarm), otherwise from the positions of all the bodies
+    self.proximity = proximity
+    self.proximity_data = None
+    if self.proximity:
+      rospy.Subscriber("/proximity/id_"+str(my_id),Proximity, self.__set_proximity)
+    else:
+      #one message per mocap frame with all the bodies
+      rospy.Subscriber("/body_data/all",QuadPositionDerivedArray, self.__set_states)
       
   def get_potential_output(self):
-    distances = self.__get_distances()
-    directions = self.__get_directions()
-    u = [0., 0., 0.]
-    for i in range(0,len(distances)):
-      if(distances[i] < 0.1):
-        for j in range(0,2):
-          u[j] += self.gain/0.1*directions[i][j]
-          u[2] += self.gain_z/0.1 * directions[i][2] 
-      else:
-        for j in range(0,2):
-          u[j] += self.gain/distances[i]*directions[i][j]
-          u[2] += self.gain_z/distances[i]*directions[i][2]
-    return u   
+    if self.proximity:
+      if self.proximity_data is None:
+        return [0., 0., 0.]
+      return list(self.proximity_data.repulsion)
+    distances, directions = self.__get_neighbours()
+    return Potential(distances,directions,self.gain,self.gain_z)
     
 
   def get_blending_constant(self):
-    alpha_max = 0.8  			# <= 1.
-    alpha_min = 0.			# >=0.
-    r_min = 1.2 			
-    r_max = 2.
-    k = (alpha_min - alpha_max)/(r_max - r_min)
-    m = alpha_max - k * r_min
-    distances = self.__get_distances()
-    if self.gain == 0:
-      return 0
-    elif min(distances) <= r_min:
-      return alpha_max
-    elif min(distances) > r_max:
-       return alpha_min
-    else:
-      return (k*min(distances) + m)
+    if self.proximity:
+      if self.proximity_data is None:
+        return 0
+      return self.proximity_data.alpha
+    distances, directions = self.__get_neighbours()
+    return Blending_Constant(distances,self.gain)
     
     
+  def __set_proximity(self,data):
+    self.proximity_data = data
+
   def __set_states(self,data):
-    topic_name = data._connection_header["topic"]
-    for i in range(0,len(self.bodies)):
-      name = "/body_data/id_" + str(self.bodies[i])
-      if topic_name == name:
-        self.states[i] = data 
+    positions = self.positions.copy()
+    for i in range(0,len(data.ids)):
+      if data.ids[i] in self.indices:
+        body = data.bodies[i]
+        positions[self.indices[data.ids[i]]] = (body.x,body.y,body.z)
+    self.positions = positions
   
-  def __get_my_state(self):
-    for i in range(0,len(self.bodies)):
-      if self.bodies[i] == self.my_id:
-        return self.states[i]
-    
-  def __get_distances(self):
-    distances = []
-    for i in range(0,len(self.states)):
-      if self.bodies[i] != self.my_id:
-        distance = self.tg.get_distance(self.__get_pos_from_state(self.__get_my_state()),self.__get_pos_from_state(self.states[i]))
-        distances.append(distance)
-    return distances
-
-  def __get_directions(self):
-    directions = []
-    for i in range(0,len(self.states)):
-      if self.bodies[i] != self.my_id:
-        direction = self.tg.get_direction2(self.__get_pos_from_state(self.__get_my_state()),self.__get_pos_from_state(self.states[i]))
-        directions.append(direction)
-    return directions
-
-
-  def __get_pos_from_state(self, state):
-    return [state.x,state.y,state.z]
- 
+  def __get_neighbours(self):
+    #distances to the other bodies and unit directions away from them, computed once per mocap frame
+    #and shared by the potential field and the blending constant
+    positions = self.positions
+    if positions is not self.neighbours_positions:
+      if self.my_index is None:
+        offsets = numpy.zeros((0,3))
+      else:
+        offsets = positions[self.my_index] - positions[self.others]
+      distances = numpy.sqrt((offsets*offsets).sum(axis=1))
+      directions = numpy.zeros_like(offsets)
+      apart = distances > 0.
+      directions[apart] = offsets[apart]/distances[apart,numpy.newaxis]
+      self.neighbours = (distances, directions)
+      self.neighbours_positions = positions
+    return self.neighbours
+
   #def __get_acceleration(self):
     #distances = self.__get_distances()
     #directions = self.__get_directions()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+#Proximity of the bodies of the swarm, computed once per mocap frame for all the drones
+#The bodies are hashed into a uniform grid of cells of side r_max, so only the bodies in the same or in
+#the 26 surrounding cells of a body are candidates; the candidate pairs of all the cells are evaluated
+#at once, and only the pairs closer than r_max are kept
+#For every drone, the repulsion and the blending constant of the avoidance controller (see
+#obstacle_avoidance.py) and the list of its neighbours are published on /proximity/id_<id>,
+#read by the blenders started with the proximity_node parameter
+#Bodies further than r_max do not repel: the blending constant is 0 beyond r_max anyway
+
+import rospy
+import numpy as np
+import sml_setup
+from mocap.msg import QuadPositionDerivedArray
+from controller.msg import Proximity
+from obstacle_avoidance import Potential, Blending_Constant, GAIN, GAIN_Z, R_MAX
+
+import analysis
+import loop_stats
+
+#*************Constants*******************
+NODE_NAME='PX'
+#*****************************************
+
+
+def Neighbours(positions,r_max):
+	#for each of the (N,3) positions, the indices, distances and unit directions (away from them)
+	#of the other positions closer than r_max
+	n=len(positions)
+	if n==0:
+		return []
+
+	#cell of every body, numbered in a grid padded by one cell so that the neighbouring cells never wrap around
+	cells=np.floor(positions/r_max).astype(int)
+	cells-=cells.min(axis=0)-1
+	shape=cells.max(axis=0)+2
+	keys=np.ravel_multi_index(cells.T,shape)
+	order=np.argsort(keys,kind='mergesort')
+	cell_keys,start,count=np.unique(keys[order],return_index=True,return_counts=True)
+
+	#pairs of occupied cells that touch, a cell with itself included
+	steps=np.array([(dx*shape[1]+dy)*shape[2]+dz for dx in (-1,0,1) for dy in (-1,0,1) for dz in (-1,0,1)])
+	neighbour_keys=cell_keys[:,np.newaxis]+steps[np.newaxis,:]
+	found=np.minimum(np.searchsorted(cell_keys,neighbour_keys),len(cell_keys)-1)
+	cell_a,step=np.nonzero(cell_keys[found]==neighbour_keys)
+	cell_b=found[cell_a,step]
+
+	#every pair of bodies of these pairs of cells
+	pairs=count[cell_a]*count[cell_b]
+	pair=np.repeat(np.arange(len(cell_a)),pairs)
+	rank=np.arange(pairs.sum())-np.repeat(np.cumsum(pairs)-pairs,pairs)
+	i=order[start[cell_a][pair]+rank//count[cell_b][pair]]
+	j=order[start[cell_b][pair]+rank%count[cell_b][pair]]
+
+	#only the pairs closer than r_max
+	offsets=positions[i]-positions[j]
+	distances=np.sqrt((offsets*offsets).sum(axis=1))
+	close=(distances<=r_max)&(i!=j)
+	i=i[close]
+	j=j[close]
+	offsets=offsets[close]
+	distances=distances[close]
+	directions=np.zeros_like(offsets)
+	apart=distances>0.
+	directions[apart]=offsets[apart]/distances[apart,np.newaxis]
+
+	#grouped by body
+	by_body=np.argsort(i,kind='mergesort')
+	bounds=np.searchsorted(i[by_body],np.arange(n+1))
+	j=j[by_body]
+	distances=distances[by_body]
+	directions=directions[by_body]
+	return [(j[bounds[k]:bounds[k+1]],distances[bounds[k]:bounds[k+1]],directions[bounds[k]:bounds[k+1]]) for k in range(0,n)]
+
+
+class ProximityNode():
+	def __init__(self):
+		#drones to publish for, all the found bodies if empty
+		self.drones=sml_setup.Get_Parameter(NODE_NAME,'drones',[])
+		self.r_max=sml_setup.Get_Parameter(NODE_NAME,'r_max',R_MAX)
+		self.publishers={}
+		self.stats=loop_stats.LoopStats('proximity',None,sml_setup.Get_Parameter(NODE_NAME,'loop_stats_interval',10.))
+		rospy.Subscriber('/body_data/all',QuadPositionDerivedArray,self.new_frame)
+
+	def get_publisher(self,body_id):
+		if body_id not in self.publishers:
+			self.publishers[body_id]=rospy.Publisher('/proximity/id_'+str(body_id),Proximity,queue_size=10)
+		return self.publishers[body_id]
+
+	def new_frame(self,data):
+		self.stats.start()
+		#only the bodies seen in this frame
+		found=[i for i in range(0,len(data.ids)) if data.bodies[i].found_body]
+		ids=np.array([data.ids[i] for i in found],dtype=int)
+		positions=np.array([[data.bodies[i].x,data.bodies[i].y,data.bodies[i].z] for i in found]).reshape(-1,3)
+		neighbours=Neighbours(positions,self.r_max)
+
+		drones=self.drones if self.drones else ids.tolist()
+		index=dict((body_id,i) for i,body_id in enumerate(ids.tolist()))
+		for body_id in drones:
+			if body_id not in index:
+				continue
+			near,distances,directions=neighbours[index[body_id]]
+			msg=Proximity()
+			msg.header=data.header
+			msg.id=body_id
+			msg.repulsion=Potential(distances,directions,GAIN,GAIN_Z)
+			msg.alpha=Blending_Constant(distances,GAIN)
+			msg.neighbours=ids[near].tolist()
+			msg.distances=distances.tolist()
+			self.get_publisher(body_id).publish(msg)
+		self.stats.stop()
+
+
+if __name__=='__main__':
+	rospy.init_node('proximity')
+	node=ProximityNode()
+	rospy.spin()
+
+#EOF
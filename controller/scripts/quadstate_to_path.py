@@ -7,15 +7,18 @@ from std_msgs.msg import Header
 from geometry_msgs.msg import Pose, Point, PoseStamped, Quaternion, Vector3, Quaternion
 import tf
 import math
+import analysis
+import path_buffer
 
 # This scripts listens to planned trajectory paths and enables a
 # visualization of them by converting them to Path msgs. It also
 # listens the the actual path of the robot and therefore enables a
 # visualization of the error.
+# Only the last poses of each path are kept and published (see
+# analysis/scripts/path_buffer.py), so long flights do not slow rviz down.
 
 
 def listener():
-    rospy.init_node('visualizer')
     rospy.Subscriber('trajectory_gen/target',QuadPositionDerived, planned_path_converter)
     rospy.Subscriber('security_guard/data_forward',QuadPositionDerived, actual_path_converter) # change?
     rospy.spin()
@@ -25,8 +28,8 @@ def planned_path_converter(quadstate):
     quat = tf.transformations.quaternion_from_euler(math.radians(quadstate.roll), math.radians(quadstate.pitch), math.radians(quadstate.yaw))
     pose = Pose(Point(quadstate.x, quadstate.y, quadstate.z), Quaternion(*quat))
     pose_stamped = PoseStamped(Header(0, rospy.Time.now(), "/map"), pose)
-    planned_path.poses.append(pose_stamped)
-    pub_planned.publish(planned_path)
+    planned_path.add(pose_stamped)
+    planned_path.publish()
 
     pub_planned_marker.publish(pose_stamped)
 
@@ -35,18 +38,22 @@ def actual_path_converter(quadstate):
     quat = tf.transformations.quaternion_from_euler(math.radians(quadstate.roll), math.radians(quadstate.pitch), math.radians(quadstate.yaw))
     pose = Pose(Point(quadstate.x, quadstate.y, quadstate.z), Quaternion(*quat))
     pose_stamped = PoseStamped(Header(0, rospy.Time.now(), "/map"), pose)
-    actual_path.poses.append(pose_stamped)
-    pub_actual.publish(actual_path)
+    actual_path.add(pose_stamped)
+    actual_path.publish()
     
     pub_actual_marker.publish(pose_stamped)
 
 if __name__ == '__main__':
-    planned_path = Path()
-    planned_path.header.frame_id = "/map"
-    actual_path = Path()
-    actual_path.header.frame_id = "/map"
+    rospy.init_node('visualizer')
     pub_planned = rospy.Publisher('visualizer/planned_path',Path, queue_size=10)
     pub_actual = rospy.Publisher('visualizer/actual_path',Path, queue_size=10)
+    # size and resolution of the drawn paths
+    capacity = int(rospy.get_param('path_capacity', 1000))
+    min_distance = rospy.get_param('path_min_distance', 0.02)
+    max_rate = rospy.get_param('path_max_rate', 10.0)
+    segments = rospy.get_param('path_segments', False)
+    planned_path = path_buffer.PathBuffer(pub_planned, "/map", capacity, min_distance, max_rate=max_rate, segments=segments)
+    actual_path = path_buffer.PathBuffer(pub_actual, "/map", capacity, min_distance, max_rate=max_rate, segments=segments)
     pub_actual_marker = rospy.Publisher('visualizer/actual_marker',PoseStamped, queue_size=10)
     pub_planned_marker = rospy.Publisher('visualizer/planned_marker',PoseStamped, queue_size=10)
     listener()
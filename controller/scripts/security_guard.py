@@ -3,15 +3,22 @@
 #Security feature of autonomous drone flight in the SML lab
 #Checks the data coming from Qualysis, as well as the safety boundaries set for the drone
 #In case of violations, disables the controller, and enables the landing node
+#In predictive mode, the position is extrapolated with the velocity and acceleration of the drone, and
+#a boundary crossing expected sooner than the latency of the pipeline lands the drone (or brakes it,
+#the blender then holds the current position)
 
 import rospy
 import sml_setup
+import geofence
 import sys
 from mocap.msg import QuadPositionDerived
 from controller.msg import Permission
+from std_srvs.srv import Empty
 
 import analysis
 import utils
+import loop_stats
+import quad_state
 
 #*************Constants*******************
 NODE_NAME='SG'
@@ -22,29 +29,15 @@ class Trajectory():
 		self.is_done=False
 
 
-class Point():
+class Point(quad_state.QuadState):
+	#state of the quad (see quad_state.py), and the arrival time of the last message
+	__slots__=('time','time_secs')
+
 	def __init__(self):
-		self.found_body=True
-		self.x=0
-		self.y=0
-		self.z=0
-		self.yaw=0
-		self.pitch=0
-		self.roll=0
-		self.x_vel=0
-		self.y_vel=0
-		self.z_vel=0
-		self.yaw_vel=0
-		self.pitch_vel=0
-		self.roll_vel=0
-		self.x_acc=0
-		self.y_acc=0
-		self.z_acc=0
-		self.yaw_acc=0
-		self.pitch_acc=0
-		self.roll_acc=0
+		quad_state.QuadState.__init__(self)
 		self.time=rospy.Time.now()
 		self.time_secs=0
+		self.stamp=rospy.Time()
 
 	def update_time(self):
 		time_now=rospy.Time.now()
@@ -88,31 +81,56 @@ def Prepare_For_Flight():
 
 
 
-def Within_Boundaries(x,y,z):
+class Boundaries():
+	#Holds the geofence, read once from the parameter server so that the check in the loop is pure arithmetic
+	#The security_guard/reload_geofence service reads the parameters again and swaps in a new geofence
+	def __init__(self):
+		self.geofence=geofence.Load_Geofence()
+		utils.loginfo('Geofence: '+str(self.geofence))
+		rospy.Service('security_guard/reload_geofence',Empty,self.reload_geofence)
+
+	def reload_geofence(self,msg):
+		self.geofence=geofence.Load_Geofence()
+		utils.loginfo('Geofence reloaded: '+str(self.geofence))
+		return []
+
+
+def Within_Boundaries(x,y,z,fence):
 	#Check whether the quad is within the safety area
-	shape = rospy.get_param('security_guard/shape','cube')
-	centerx = float(rospy.get_param('security_guard/centerx',0.0))
-	centery = float(rospy.get_param('security_guard/centery',0.0))
-
-	if shape == 'cube':
-		side = float(rospy.get_param('security_guard/side',4.0))
-		return x>=(centerx - side/2) and x<=(centerx + side/2) and y>=(centery - side/2) and y<=(centery + side/2) and z<=side
-
-	radius = float(rospy.get_param('security_guard/radius',0))
-	if shape == 'hemisphere':
-		return ((x-centerx)**2 + (y-centery)**2 + z**2)<=radius**2
-	height = float(rospy.get_param('security_guard/height',0))
-	if shape == 'cylinder':
-		return ((x-centerx)**2 + (y-centery)**2)<=radius**2 and z<=height
+	inside,distance=fence.check([[x,y,z]])
+	return inside[0]
+
+
+def Pipeline_Latency(current_point,reaction_time):
+	#age of the measurement, from its capture time (or its arrival if it is not stamped), plus the reaction time
+	if current_point.stamp.is_zero():
+		age=current_point.get_time()
+	else:
+		age=(rospy.Time.now()-current_point.stamp).to_sec()
+	return max(age,0.)+reaction_time
+
+
+def Time_To_Violation(current_point,fence,horizon):
+	#time before the drone leaves the safety area if it keeps its velocity and acceleration
+	return fence.time_to_violation([current_point.pos],[current_point.vel],[current_point.acc],horizon)[0]
+
+
+def Boundary_Crossing_Expected(current_point,fence,horizon,reaction_time):
+	#True when the drone is expected to leave the safety area sooner than the pipeline can react
+	time_to_violation=Time_To_Violation(current_point,fence,horizon)
+	latency=Pipeline_Latency(current_point,reaction_time)
+	if time_to_violation<latency:
+		utils.logerr('Boundary crossing expected in %.2f s (latency %.2f s).'%(time_to_violation,latency))
+		return True
 	return False
 
 
-def Security_Check(current_point):
+def Security_Check(current_point,fence):
 	keep_controller=False
 
 	if current_point.get_time()<0.5:
 		if current_point.found_body:
-			if Within_Boundaries(current_point.x,current_point.y,current_point.z):
+			if Within_Boundaries(current_point.x,current_point.y,current_point.z,fence):
 				keep_controller=True
 			else:
 				utils.logerr('Out of boundaries.')
@@ -138,50 +156,13 @@ def Trajectory_Done(data,end_trajectory):
 
 
 def New_Point(data,point_obj):
-	point_obj.found_body=data.found_body
-	point_obj.x=data.x
-	point_obj.y=data.y
-	point_obj.z=data.z
-	point_obj.yaw=data.yaw
-	point_obj.pitch=data.pitch
-	point_obj.roll=data.roll
-	point_obj.x_vel=data.x_vel
-	point_obj.y_vel=data.y_vel
-	point_obj.z_vel=data.z_vel
-	point_obj.yaw_vel=data.yaw_vel
-	point_obj.pitch_vel=data.pitch_vel
-	point_obj.roll_vel=data.roll_vel
-	point_obj.x_acc=data.x_acc
-	point_obj.y_acc=data.y_acc
-	point_obj.z_acc=data.z_acc
-	point_obj.yaw_acc=data.yaw_acc
-	point_obj.pitch_acc=data.pitch_acc
-	point_obj.roll_acc=data.roll_acc
+	point_obj.update(data)
 	point_obj.update_time()
 	return
 
 
 def Get_Quad_State(obj):
-	result=QuadPositionDerived()
-	result.found_body=obj.found_body
-	result.x=obj.x
-	result.y=obj.y
-	result.z=obj.z
-	result.yaw=obj.yaw
-	result.pitch=obj.pitch
-	result.roll=obj.roll
-	result.x_vel=obj.x_vel
-	result.y_vel=obj.y_vel
-	result.z_vel=obj.z_vel
-	result.yaw_vel=obj.yaw_vel
-	result.pitch_vel=obj.pitch_vel
-	result.roll_vel=obj.roll_vel
-	result.x_acc=obj.x_acc
-	result.y_acc=obj.y_acc
-	result.z_acc=obj.z_acc
-	result.yaw_acc=obj.yaw_acc
-	result.pitch_acc=obj.pitch_acc
-	result.roll_acc=obj.roll_acc
+	result=obj.to_msg(QuadPositionDerived())
 	result.time_diff=obj.time_secs
 	return(result)
 
@@ -204,6 +185,7 @@ if __name__=='__main__':
 	lander_channel=rospy.Publisher('security_guard/lander',Permission,queue_size=10)
 	controller_channel=rospy.Publisher('security_guard/controller',Permission,queue_size=10)
 	data_forward=rospy.Publisher('security_guard/data_forward',QuadPositionDerived,queue_size=10)
+	brake_channel=rospy.Publisher('security_guard/brake',Permission,queue_size=10)
 
 	#Subscribe topics
 	rospy.Subscriber(mocap_topic,QuadPositionDerived,New_Point,current_point)
@@ -212,6 +194,21 @@ if __name__=='__main__':
 	#Connect to Qualysis Motion Capture System
 	body_info=sml_setup.Connect_To_Mocap_Message(NODE_NAME)
 
+	#Safety area, read from the parameters once (and on security_guard/reload_geofence)
+	boundaries=Boundaries()
+
+	#Predictive mode: look horizon seconds ahead, react ('land' or 'brake') when the crossing is closer than
+	#the age of the data plus reaction_time
+	predictive=sml_setup.Get_Parameter(NODE_NAME,'predictive',False)
+	horizon=sml_setup.Get_Parameter(NODE_NAME,'prediction_horizon',1.0)
+	reaction_time=sml_setup.Get_Parameter(NODE_NAME,'reaction_time',0.3)
+	violation_action=sml_setup.Get_Parameter(NODE_NAME,'violation_action','land')
+	brake_permission=Permission()
+	brake_permission.permission=False
+
+	#Timing of the security check, logged every loop_stats_interval seconds
+	check_stats=loop_stats.LoopStats('security check',1./30,sml_setup.Get_Parameter(NODE_NAME,'loop_stats_interval',10.))
+
 
 	#Prepare the Iris for flight (set system ID and arm)
 	#ready_to_fly=Prepare_For_Flight()
@@ -221,7 +218,16 @@ if __name__=='__main__':
 
 	
 	while not rospy.is_shutdown():
-		controller_on=Security_Check(current_point)
+		check_stats.start()
+		controller_on=Security_Check(current_point,boundaries.geofence)
+		if controller_on and predictive and not brake_permission.permission:
+			if Boundary_Crossing_Expected(current_point,boundaries.geofence,horizon,reaction_time):
+				if violation_action=='brake':
+					utils.logerr('Braking, holding position')
+					brake_permission.permission=True
+				else:
+					controller_on=False
+		check_stats.stop()
 		if trajectory_done.is_done:
 			controller_on=False
 
@@ -240,9 +246,10 @@ if __name__=='__main__':
 
 		lander_channel.publish(lander_permission)
 		controller_channel.publish(controller_permission)
+		brake_channel.publish(brake_permission)
 		if controller_on:
-			quad_state=Get_Quad_State(current_point)
-			data_forward.publish(quad_state)
+			forward_msg=Get_Quad_State(current_point)
+			data_forward.publish(forward_msg)
 
 		loop_rate.sleep()
 
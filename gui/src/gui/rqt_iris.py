@@ -90,6 +90,12 @@ class MyPlugin(Plugin):
         except rospy.ServiceException as exc:
             utils.loginfo("PID not reachable " + str(exc))
 
+        try:
+            geofence_load = rospy.ServiceProxy("/%s/security_guard/reload_geofence"%(self.name), Empty)
+            geofence_load()
+        except rospy.ServiceException as exc:
+            utils.loginfo("Security guard not reachable " + str(exc))
+
 
     def Connect(self):
         inputstring = "roslaunch scenarios connect.launch simulation:=%s ns:=%s" % (self.simulation,self.name)
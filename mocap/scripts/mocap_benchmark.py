@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+#Measures the frame rate and latency that mocap_source.Mocap achieves against a QTM server
+#Latencies are only meaningful against qtm_emulator.py running on the same machine,
+#whose timestamps are wall-clock microseconds (the real QTM counts from the start of the measurement)
+#The modes are:
+#   poll    ->  GetCurrentFrame requests at the frame rate of the server (what the ros_mocap nodes do by default)
+#   stream  ->  StreamFrames over the TCP connection
+#   udp     ->  StreamFrames over UDP
+#In every mode the frames are read by the reader thread of mocap_source.Mocap and timed in its frame_listener,
+#so the latency is the same quantity for all of them: from the capture of a frame to its arrival in the client
+
+### To run, use for example "rosrun mocap mocap_benchmark.py -H 127.0.0.1 -p 22224 -m stream -d 10"
+
+import argparse
+import sys
+import time
+import numpy
+import mocap_source
+
+
+def build_parser():
+	"""Creates parser for command line arguments """
+	parser = argparse.ArgumentParser(description='Mocap client benchmark')
+	parser.add_argument('-H', '--host',
+	                    help='QTM (or qtm_emulator.py) host',
+	                    default='127.0.0.1',
+	                    type=str)
+	parser.add_argument('-p', '--port',
+	                    help='QTM port',
+	                    default=22224,
+	                    type=int)
+	parser.add_argument('-m', '--mode',
+	                    help='How frames are obtained',
+	                    default='poll',
+	                    choices=['poll','stream','udp'])
+	parser.add_argument('-r', '--rate',
+	                    help='Frame rate of the server, the rate of the requests in poll mode [Hz]',
+	                    default=100.,
+	                    type=float)
+	parser.add_argument('-d', '--duration',
+	                    help='Duration of the measurement [s]',
+	                    default=10.,
+	                    type=float)
+	return parser
+
+
+class FrameTimer():
+	#frame_listener recording the capture-to-arrival latency of every new frame
+	def __init__(self):
+		self.latencies=[]
+		self.framenumbers=set()
+
+	def __call__(self,msg,packet):
+		arrival=time.time()
+		if msg['type']!='Data' or msg['framenumber'] in self.framenumbers:
+			return
+		self.framenumbers.add(msg['framenumber'])
+		self.latencies.append(arrival-msg['timestamp']/1E6)
+
+
+def Run_Benchmark(Qs,mode,rate,duration):
+	timer=FrameTimer()
+	Qs.frame_listener=timer
+	start=time.time()
+	if mode=='poll':
+		Qs.start_polling(rate)
+	elif mode=='stream':
+		Qs.start_streaming()
+	else:
+		Qs.start_streaming(udp_port=0)
+	time.sleep(duration)
+	Qs.stop_streaming()
+	elapsed=time.time()-start
+	return len(timer.framenumbers)/elapsed,numpy.array(timer.latencies)*1E3
+
+
+if __name__=='__main__':
+	args=build_parser().parse_args()
+	Qs=mocap_source.Mocap(host=args.host,port=args.port,info=0)
+	if Qs.socket is None:
+		print('No connection to '+args.host+':'+str(args.port))
+		sys.exit(1)
+	rate,latencies=Run_Benchmark(Qs,args.mode,args.rate,args.duration)
+
+	print('mode:            '+args.mode)
+	print('frames/s:        %.1f'%(rate))
+	if len(latencies):
+		print('latency [ms]:    mean %.3f, median %.3f, p99 %.3f, max %.3f'%(numpy.mean(latencies),numpy.median(latencies),numpy.percentile(latencies,99),numpy.max(latencies)))
+	print('dropped frames:  '+str(Qs.dropped_frames))
+
+#EOF
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+#Single owner of the connection to the Qualysis motion capture system
+#Streams the frames from QTM once and shares them with any number of local consumers:
+#   mocap_broker/id_N           ->  topic with the QuadPosition of body N, published for every new frame
+#   mocap_get_data(body_id)     ->  service returning the latest QuadPosition of a body (BodyData)
+#   mocap_get_data_batch(ids)   ->  service returning the latest QuadPosition of several bodies (BodiesData),
+#                                   of all the bodies of the frame if ids is empty
+#   Unix socket (mocap_broker_path, default mocap_source.BROKER_PATH)
+#                               ->  raw QTM frames, read with mocap_source.BrokerClient,
+#                                   without any handshake or TakeControl of their own
+#Slow socket clients only ever get the latest frame, they never hold the others back
+
+import os
+import socket
+import sys
+import threading
+import numpy
+import rospy
+import sml_setup
+import mocap_source
+
+from mocap.msg import QuadPosition
+from mocap.srv import BodyData
+from mocap.srv import BodiesData
+
+import analysis
+import utils
+
+#************Constants********************
+NODE_NAME='MOCAP_BROKER'
+#*****************************************
+
+
+def Get_Positions(msg):
+	#QuadPosition of every body of a decoded QTM frame, indexed by body id
+	positions={}
+	for i in range(0,len(msg['bodies'])):
+		body=msg['bodies'][i]
+		data=QuadPosition()
+		data.found_body=not numpy.isnan(body).any()
+		if data.found_body:
+			data.x=body[0]/1000.
+			data.y=body[1]/1000.
+			data.z=body[2]/1000.
+			data.roll=body[3]
+			data.pitch=body[4]
+			data.yaw=body[5]
+		positions[i+1]=data
+	return positions
+
+
+class SocketClient():
+	def __init__(self,connection):
+		self.connection=connection
+		self.pending=None
+		self.ready=threading.Event()
+		self.connected=True
+		thread=threading.Thread(target=self.send_loop)
+		thread.daemon=True
+		thread.start()
+
+	def push(self,packet):
+		#only the latest frame is kept for a client that is still busy with the previous one
+		self.pending=packet
+		self.ready.set()
+
+	def send_loop(self):
+		while self.connected:
+			self.ready.wait()
+			self.ready.clear()
+			packet=self.pending
+			if packet is None:
+				continue
+			try:
+				self.connection.sendall(packet)
+			except socket.error:
+				self.connected=False
+		self.connection.close()
+
+
+class SocketServer():
+	def __init__(self,path):
+		if os.path.exists(path):
+			os.remove(path)
+		self.listener=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+		self.listener.bind(path)
+		self.listener.listen(16)
+		#the clients are added by the accept thread and pruned by the QTM reader thread
+		self.clients=[]
+		self.clients_lock=threading.Lock()
+		thread=threading.Thread(target=self.accept_loop)
+		thread.daemon=True
+		thread.start()
+
+	def accept_loop(self):
+		while True:
+			connection,address=self.listener.accept()
+			with self.clients_lock:
+				self.clients.append(SocketClient(connection))
+				connected=len(self.clients)
+			utils.loginfo('New local mocap client ('+str(connected)+' connected)')
+
+	def publish(self,msg,packet):
+		with self.clients_lock:
+			self.clients=[client for client in self.clients if client.connected]
+			clients=self.clients
+		for client in clients:
+			client.push(packet)
+
+
+class MocapBroker():
+	def __init__(self):
+		host=sml_setup.Get_Parameter(NODE_NAME,'mocap_host',None)
+		port=sml_setup.Get_Parameter(NODE_NAME,'mocap_port',None)
+		frequency=sml_setup.Get_Parameter(NODE_NAME,'mocap_stream_frequency',None)
+		udp_port=sml_setup.Get_Parameter(NODE_NAME,'mocap_stream_udp_port',None)
+		path=sml_setup.Get_Parameter(NODE_NAME,'mocap_broker_path',mocap_source.BROKER_PATH)
+
+		self.Qs=mocap_source.Mocap(host,port,info=0)
+		if self.Qs.socket is None:
+			utils.logerr('No connection to the Qualisys Motion Capture System')
+			sys.exit()
+
+		self.positions={}
+		self.publishers={}
+		self.server=SocketServer(path)
+		#the topics are published by the QTM reader thread, as soon as a frame arrives
+		self.Qs.frame_listener=self.new_frame
+		self.Qs.start_streaming(frequency,udp_port)
+
+		rospy.Service('mocap_get_data',BodyData,self.get_data)
+		rospy.Service('mocap_get_data_batch',BodiesData,self.get_data_batch)
+		rospy.on_shutdown(self.Qs._stop_measurement)
+
+	def get_data(self,request):
+		positions=self.positions
+		if request.id in positions:
+			return positions[request.id]
+		return QuadPosition()
+
+	def get_data_batch(self,request):
+		positions=self.positions
+		ids=list(request.ids)
+		if not ids:
+			ids=sorted(positions.keys())
+		return ids,[positions.get(body_id,QuadPosition()) for body_id in ids]
+
+	def get_publisher(self,body_id):
+		if body_id not in self.publishers:
+			self.publishers[body_id]=rospy.Publisher('mocap_broker/id_'+str(body_id),QuadPosition,queue_size=10)
+		return self.publishers[body_id]
+
+	def new_frame(self,msg,packet):
+		#every new frame of the stream: the socket clients first, then the topics
+		self.server.publish(msg,packet)
+		positions=Get_Positions(msg)
+		self.positions=positions
+		for body_id in positions:
+			data=positions[body_id]
+			#bodies that were never seen do not get a topic
+			if data.found_body or body_id in self.publishers:
+				self.get_publisher(body_id).publish(data)
+
+	def run(self):
+		#the frames are handled by new_frame, only watch the connection
+		rate=rospy.Rate(10)
+		while not rospy.is_shutdown():
+			if not self.Qs.streaming:
+				utils.logerr('Lost the connection to the Qualisys Motion Capture System')
+				return
+			rate.sleep()
+
+
+if __name__=="__main__":
+	rospy.init_node("mocap_broker")
+	MocapBroker().run()
+
+#EOF
@@ -6,6 +6,7 @@ import math
 import time
 import errno
 from socket import error as socket_error
+from mocap_source import _parser_comm
 
 class Mocap(object):
 
@@ -4,6 +4,13 @@ import sys      #for exit
 import struct
 import math
 import time
+import threading
+import numpy
+from socket import error as socket_error
+from socket import timeout as socket_timeout
+
+#Unix socket on which mocap_broker.py shares its QTM frames with local clients
+BROKER_PATH = '/tmp/mocap_broker.sock'
 
 class Mocap(object):
 
@@ -16,11 +23,24 @@ class Mocap(object):
             port = 22224
         self.host = host
         self.port = port
+        self._init_stream()
         #create socket connection
         self.socket = self._create_connection(host,port,info)
         if self.socket is not None:
             self._start_measurement()
         
+    def _init_stream(self):
+        self.streaming = False
+        self.polling = False
+        self.udp_socket = None
+        self.dropped_frames = 0
+        #called with (msg, raw packet bytes) for every accepted streamed frame
+        self.frame_listener = None
+        self._last_framenumber = None
+        self._latest_frame = None
+        self._new_frame = threading.Event()
+        self._reader = None
+
     def _create_connection(self,host,port,printinfo):
         #create socket
         try:
@@ -88,6 +108,8 @@ class Mocap(object):
                 reply = self._send_command('New')
  
     def _stop_measurement(self):
+        if self.streaming:
+            self.stop_streaming()
         self._send_command('Close')
         #self._send_command('ReleaseControl')
         #print reply
@@ -101,10 +123,159 @@ class Mocap(object):
         except:
             None
         
+    def start_streaming(self, frequency=None, udp_port=None):
+        #ask QTM to push frames instead of answering GetCurrentFrame requests
+        #all frames are streamed unless a frequency (Hz) is given
+        #with a udp_port (0 for any free port) the frames come as UDP datagrams, commands stay on TCP
+        #a background thread keeps the latest frame, see get_latest_frame
+        if self.streaming:
+            return
+        self.stop_streaming()
+        if frequency is None:
+            rate = 'AllFrames'
+        else:
+            rate = 'Frequency:' + str(int(frequency))
+        command = 'StreamFrames ' + rate
+        if udp_port is not None:
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.bind(('', udp_port))
+            self.udp_socket.settimeout(0.1)
+            command += ' UDP:' + str(self.udp_socket.getsockname()[1])
+        self.socket.sendall(self._build_packet(command + ' 6DEuler',1))
+        self._start_reader(self._stream_loop)
+
+    def start_polling(self, frequency=None):
+        #for a QTM that does not stream: a background thread requests the frames with GetCurrentFrame,
+        #as fast as QTM answers or at most at frequency (Hz), and keeps the latest one like start_streaming
+        #stop it with stop_streaming
+        if self.streaming:
+            return
+        self.stop_streaming()
+        self.polling = True
+        if frequency is None:
+            self._poll_period = 0.
+        else:
+            self._poll_period = 1./frequency
+        self._start_reader(self._poll_loop)
+
+    def _start_reader(self, target):
+        self._latest_frame = None
+        self._last_framenumber = None
+        self._new_frame.clear()
+        self.streaming = True
+        self._reader = threading.Thread(target=target)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def stop_streaming(self):
+        #also cleans up after a reader thread that stopped on its own
+        if self._reader is None:
+            return
+        self.streaming = False
+        self._reader.join()
+        self._reader = None
+        if self.polling:
+            self.polling = False
+        else:
+            if self.udp_socket is not None:
+                self.udp_socket.close()
+                self.udp_socket = None
+            try:
+                self.socket.sendall(self._build_packet('StreamFrames Stop',1))
+            except socket_error:
+                return
+        #drop the frames that were already on their way (a stream out of step is dropped as a whole)
+        try:
+            while _parser_comm(self.socket) is not None:
+                pass
+        except Exception:
+            pass
+
+    def _poll_loop(self):
+        while self.streaming:
+            started = time.time()
+            try:
+                self.socket.sendall(self._build_packet('GetCurrentFrame 6DEuler',1))
+                packet = _read_packet(self.socket)
+                if packet is not None:
+                    msg = _decode_packet(*packet)
+            except Exception as e:
+                self._reader_stopped('Mocap polling stopped: ' + str(e))
+                return
+            if packet is not None and msg['type'] == 'Data' and not self._is_stale(msg['framenumber']):
+                self._set_latest_frame(msg, packet)
+            wait = self._poll_period - (time.time() - started)
+            if wait > 0:
+                time.sleep(wait)
+
+    def _stream_loop(self):
+        while self.streaming:
+            try:
+                if self.udp_socket is None:
+                    packet = _read_packet(self.socket)
+                else:
+                    packet = _read_datagram(self.udp_socket)
+            except Exception as e:
+                self._reader_stopped('Mocap stream stopped: ' + str(e))
+                return
+            if packet is None:
+                continue
+            try:
+                msg = _decode_packet(*packet)
+            except Exception as e:
+                if self.udp_socket is None:
+                    #the TCP stream is out of step, nothing after this packet can be trusted
+                    self._reader_stopped('Mocap stream stopped, undecodable packet: ' + str(e))
+                    return
+                #a corrupted datagram is just a lost frame
+                self.dropped_frames += 1
+                continue
+            if msg['type'] != 'Data':
+                continue
+            if self._is_stale(msg['framenumber']):
+                self.dropped_frames += 1
+                continue
+            self._set_latest_frame(msg, packet)
+
+    def _reader_stopped(self, reason):
+        #the reader thread gives up: wake up the waiting readers, which see streaming False
+        #stop_streaming still has to be called to stop QTM and close the sockets
+        print (reason)
+        self.streaming = False
+        self._new_frame.set()
+
+    def _set_latest_frame(self, msg, packet):
+        #a single reference assignment, readers never see a half-updated frame
+        self._latest_frame = msg
+        self._new_frame.set()
+        if self.frame_listener is not None:
+            self.frame_listener(msg, bytes(packet[0][:packet[1]]))
+
+    def _is_stale(self, framenumber):
+        #datagrams can be lost or arrive out of order: only frames newer than the last one are kept
+        last = self._last_framenumber
+        if last is not None and framenumber <= last and last - framenumber < _FRAME_RESET_GAP:
+            return True
+        self._last_framenumber = framenumber
+        return False
+
+    def get_latest_frame(self, timeout=None):
+        #latest streamed frame, without any request to QTM
+        #with a timeout, wait up to that many seconds for a frame newer than the last one returned
+        if timeout is not None:
+            self._new_frame.wait(timeout)
+        self._new_frame.clear()
+        return self._latest_frame
+
     def find_available_bodies(self, printinfo=True):
-        if self.ask_for_6DOFinfo() == None:
-            return None
-        msg = _parser_comm(self.socket)
+        if self.streaming:
+            msg = self.get_latest_frame()
+            if msg is None: #nothing streamed yet
+                msg = self.get_latest_frame(timeout=1.0)
+        else:
+            if self.ask_for_6DOFinfo() == None:
+                return None
+            msg = _parser_comm(self.socket)
         if msg == None:
             return None
         valid = []
@@ -142,6 +313,51 @@ class Mocap(object):
             bodies_list.append(new_pose)
         return bodies_list
 
+class BrokerClient(Mocap):
+    #Mocap client fed by mocap_broker.py through a local Unix socket instead of its own QTM connection
+    #there is no handshake and no master control: the broker streams every frame as soon as we connect
+
+    def __init__(self, path=None, info=0):
+        if path is None:
+            path = BROKER_PATH
+        self.host = path
+        self.port = None
+        self._init_stream()
+        self.socket = self._create_connection(path,None,info)
+        if self.socket is not None:
+            self._start_reader(self._stream_loop)
+
+    def _create_connection(self,path,port,printinfo):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(0.1)
+        try:
+            s.connect(path)
+        except:
+            return None
+        if printinfo:
+            print ('Connected to the mocap broker on ' + path + '\n')
+        return s
+
+    def start_streaming(self, frequency=None, udp_port=None):
+        #the broker decides the stream rate, we only (re)start reading
+        if not self.streaming:
+            self.stop_streaming()
+            self._start_reader(self._stream_loop)
+
+    def start_polling(self, frequency=None):
+        #nothing to poll, the broker pushes its frames anyway
+        self.start_streaming()
+
+    def stop_streaming(self):
+        if self._reader is not None:
+            self.streaming = False
+            self._reader.join()
+            self._reader = None
+
+    def _stop_measurement(self):
+        self.stop_streaming()
+        self.socket.close()
+
 class Body(object):
 
     def __init__(self, mocap, bodynr, bodytype=None):
@@ -195,67 +411,145 @@ class Body(object):
         else:
             raise Exception('Invalid data type request')
         dof['ts']=timestamp
+        dof['frame']=msg['framenumber']
         dof['id']=self.bodynr
         return dof
 
 
-def _parser_comm(socket):
-    msg = {'size':None, 'type':None, 'message':None, 'bodies':None, 'timestamp':None}
-    try:
-        msg_size_bytes = socket.recv(4) #receive the size of the package
-    except:
+#QTM RT protocol layouts (all fields are big-endian)
+_PACKET_HEADER = struct.Struct('>ll')           #packet size, packet type
+_DATA_HEADER = struct.Struct('>qll')            #timestamp, frame number, component count
+_COMPONENT_HEADER = struct.Struct('>ll')        #component size, component type
+_EULER_HEADER = struct.Struct('>lhh')           #body count, 2D drop rate, 2D out of sync rate
+_EULER_BODY_DTYPE = numpy.dtype('>f4')          #x, y, z, a1, a2, a3 for each body
+_MSG_TYPES = ['Error','Command','XML','Data','No more data','C3D file','Event']
+
+#how long we keep waiting for the rest of a packet once its first bytes arrived
+_PACKET_TIMEOUT = 1.0
+
+#a frame number this far behind the last one means QTM restarted the measurement, not a late frame
+_FRAME_RESET_GAP = 1000
+
+#largest UDP datagram QTM can send
+_MAX_DATAGRAM_SIZE = 65535
+
+#receive buffers are reused between packets, one per reading thread
+_buffers = threading.local()
+
+
+def _get_buffer(size):
+    buf = getattr(_buffers, 'data', None)
+    if buf is None or len(buf) < size:
+        buf = bytearray(max(size, 4096))
+        _buffers.data = buf
+    return buf
+
+
+def _recv_exact(socket, view, nbytes, started):
+    #fill view[:nbytes] from the socket, looping over short reads
+    #a timeout before anything of the packet arrived gives up at once (no data available),
+    #once the packet has started we wait up to _PACKET_TIMEOUT for the rest of it
+    received = 0
+    deadline = None
+    while received < nbytes:
+        try:
+            n = socket.recv_into(view[received:nbytes], nbytes - received)
+        except socket_timeout:
+            if received == 0 and not started:
+                return 0
+            if deadline is None:
+                deadline = time.time() + _PACKET_TIMEOUT
+            elif time.time() > deadline:
+                return received
+            continue
+        if n == 0:
+            raise socket_error('connection closed by the QTM server')
+        received += n
+    return received
+
+
+def _read_packet(socket):
+    #read one whole packet into the reusable buffer, return (buffer, size) or None if no packet is available
+    buf = _get_buffer(_PACKET_HEADER.size)
+    received = _recv_exact(socket, memoryview(buf), _PACKET_HEADER.size, False)
+    if received == 0:
         return None
+    if received < _PACKET_HEADER.size:
+        raise Exception('connection to the QTM server lost in the middle of a packet header')
+
+    msg_size = _PACKET_HEADER.unpack_from(buf, 0)[0]
+    if msg_size < _PACKET_HEADER.size:
+        raise Exception('invalid packet size %i, see protocol documentation' % msg_size)
+    if len(buf) < msg_size:
+        header = buf[:_PACKET_HEADER.size]
+        buf = _get_buffer(2*msg_size)
+        buf[:_PACKET_HEADER.size] = header
 
+    payload_size = msg_size - _PACKET_HEADER.size
+    if payload_size:
+        received = _recv_exact(socket, memoryview(buf)[_PACKET_HEADER.size:], payload_size, True)
+        if received < payload_size:
+            raise Exception('connection to the QTM server lost in the middle of a packet (%i of %i bytes received)' % (received + _PACKET_HEADER.size, msg_size))
+    return buf, msg_size
+
+
+def _read_datagram(udp_socket):
+    #read one datagram into the reusable buffer, return (buffer, size) or None if nothing usable arrived
+    buf = _get_buffer(_MAX_DATAGRAM_SIZE)
     try:
-        msg_size = struct.unpack('>l', msg_size_bytes)[0] #get the decimal message size
-    except:
+        received = udp_socket.recv_into(buf, _MAX_DATAGRAM_SIZE)
+    except socket_timeout:
         return None
+    if received < _PACKET_HEADER.size or _PACKET_HEADER.unpack_from(buf, 0)[0] != received:
+        return None #truncated or malformed datagram, treated as a lost frame
+    return buf, received
 
-    msg['size']=msg_size
-    msg_type_bytes = socket.recv(4) #receive the type of message
-    msg_type_code = struct.unpack('>l', msg_type_bytes)[0] #get the message type code
-    msg_types = ['Error','Command','XML','Data','No more data','C3D file','Event']
+
+def _decode_packet(buf, msg_size):
+    #decode a complete packet held in buf[:msg_size]
+    msg = {'size':msg_size, 'type':None, 'message':None, 'bodies':None, 'timestamp':None, 'framenumber':None}
+    msg_type_code = _PACKET_HEADER.unpack_from(buf, 0)[1]
 
     try:
-        msg_type = msg_types[msg_type_code]
+        msg_type = _MSG_TYPES[msg_type_code]
     except:
         print "msg_type_code: " + str(msg_type_code)
         raise Exception('unexpexted type of message, see protocol documentation')
     msg['type']=msg_type
     if msg_type_code == 3:
-        # parse the rest of the header
-        header_timestamp = socket.recv(8)
-        timestamp = struct.unpack('>q', header_timestamp)[0]
-        header_framenumber = socket.recv(4)
-        #print(struct.unpack('>l', header_framenumber)[0] )
-        header_componentcount = socket.recv(4)
-        nr_componentcount = struct.unpack('>l', header_componentcount)[0]
+        offset = _PACKET_HEADER.size
+        timestamp, framenumber, nr_componentcount = _DATA_HEADER.unpack_from(buf, offset)
+        offset += _DATA_HEADER.size
         for ii in range(nr_componentcount): #only one iteration if you request the current frame
-            component_size = socket.recv(4)
-            nr_comp_size = struct.unpack('>l', component_size)[0]
-            component_type = socket.recv(4)
-            nr_comp_type = struct.unpack('>l', component_type)[0]
+            nr_comp_size, nr_comp_type = _COMPONENT_HEADER.unpack_from(buf, offset)
             if nr_comp_type != 6:
                 raise Exception('requested data type not manageable by the parser')
-            body_count = struct.unpack('>l',socket.recv(4))[0]
-            useless_info = socket.recv(4)
-            bodies = [0]*body_count
-            for jj in range(body_count):
-                x = struct.unpack('>f',socket.recv(4))[0]
-                y = struct.unpack('>f',socket.recv(4))[0]
-                z = struct.unpack('>f',socket.recv(4))[0]
-                a1 = struct.unpack('>f',socket.recv(4))[0]
-                a2 = struct.unpack('>f',socket.recv(4))[0]
-                a3 = struct.unpack('>f',socket.recv(4))[0]
-                bodies[jj] = [x, y, z, a1, a2, a3]
-            msg['bodies']=bodies
-            msg['timestamp']=timestamp
+            body_count = _EULER_HEADER.unpack_from(buf, offset + _COMPONENT_HEADER.size)[0]
+            bodies_offset = offset + _COMPONENT_HEADER.size + _EULER_HEADER.size
+            if bodies_offset + body_count*6*_EULER_BODY_DTYPE.itemsize > msg_size:
+                raise Exception('truncated 6DOF component, see protocol documentation')
+            #all the 6DOF Euler values of the frame in one go, copied out of the reusable buffer
+            bodies = numpy.frombuffer(buf, dtype=_EULER_BODY_DTYPE, count=body_count*6, offset=bodies_offset)
+            msg['bodies']=bodies.reshape(body_count, 6).astype(numpy.float64)
+            offset += nr_comp_size
+        msg['timestamp']=timestamp
+        msg['framenumber']=framenumber
     elif msg_type_code!=4:
-        qtm_message_bytes = socket.recv(msg_size-8) #receive the message (size+type are 8B)
+        qtm_message_bytes = bytes(buf[_PACKET_HEADER.size:msg_size]) #the message follows size+type (8B)
         qtm_message = qtm_message_bytes.decode("UTF-8")
         msg['message']=qtm_message
     return msg
 
+
+def _parser_comm(socket):
+    try:
+        packet = _read_packet(socket)
+    except socket_error:
+        return None
+    if packet is None:
+        return None
+    return _decode_packet(*packet)
+
 #if __name__ == "__main__":
 #    Qs = Mocap(info=1)
 #    bodies = Qs.find_available_bodies(printinfo=1)
@@ -8,6 +8,9 @@
 #   get_data(body_id)           ->  returns all the data from a specific body (body id passed as an argument)
 #                                   the returned data is in the service format BodyData, which contains
 #                                   x,y,z,pitch,roll,yaw
+#the poses of all the tracked bodies are requested at once from mocap_get_data_batch (BodiesData),
+#over a persistent connection; that service is only provided by mocap_broker.py, with the other mocap nodes
+#the bodies are requested one by one from mocap_get_data (BodyData)
 
 import sys
 import rospy
@@ -16,6 +19,7 @@ import tf
 
 from mocap.msg import QuadPosition
 from mocap.srv import Bodies
+from mocap.srv import BodiesData, BodiesDataResponse
 from mocap.srv import BodyData
 from gazebo_msgs.msg import ModelStates
 from geometry_msgs.msg import PoseWithCovarianceStamped, Pose
@@ -48,26 +52,27 @@ class PubMocap:
 			r.sleep()
 
 	def publish(self):
-		for (i,ns) in zip(self.track_id,self.track_ns):
-			pose = self.get_data_body(i)
-			try:
-				self.pub[i].publish(pose)
-			except rospy.ServiceException as exc:
-				print("Service did not process request: " + str(exc))
-
-	def get_data_body(self, body_id):
+		#one request for all the tracked bodies
 		try:
-			resp1 = self.call_body_data(body_id)
-		except rospy.ServiceException as exc:
+			resp1 = self.call_bodies_data(self.track_id)
+		except Exception as exc:
 			print("Service did not process request: " + str(exc))
+			#the connection may be broken, open a new one for the next request
+			self.start_service_call()
+			return
+
+		for (i,pos) in zip(resp1.ids,resp1.pos):
+			if i in self.pub:
+				self.pub[i].publish(self.get_data_body(pos))
 
+	def get_data_body(self, pos):
 		msg = PoseWithCovarianceStamped()
 		pose = Pose()
-		pose.position.x = resp1.pos.x
-		pose.position.y = resp1.pos.y
-		pose.position.z = resp1.pos.z
+		pose.position.x = pos.x
+		pose.position.y = pos.y
+		pose.position.z = pos.z
 
-		quaternion = tf.transformations.quaternion_from_euler(resp1.pos.roll, resp1.pos.pitch, resp1.pos.yaw)
+		quaternion = tf.transformations.quaternion_from_euler(pos.roll, pos.pitch, pos.yaw)
 		#type(pose) = geometry_msgs.msg.Pose
 		pose.orientation.x = quaternion[0]
 		pose.orientation.y = quaternion[1]
@@ -84,8 +89,25 @@ class PubMocap:
 		return msg
 
 	def start_service_call(self):
-		rospy.wait_for_service('/mocap_get_data')
-		self.call_body_data = rospy.ServiceProxy('mocap_get_data', BodyData)
+		#whichever of the two services shows up first
+		while not rospy.is_shutdown():
+			try:
+				rospy.wait_for_service('/mocap_get_data_batch',0.5)
+				self.call_bodies_data = rospy.ServiceProxy('mocap_get_data_batch', BodiesData, persistent=True)
+				return
+			except rospy.ROSException:
+				pass
+			try:
+				rospy.wait_for_service('/mocap_get_data',0.5)
+				self.call_body_data = rospy.ServiceProxy('mocap_get_data', BodyData, persistent=True)
+				self.call_bodies_data = self.call_bodies_one_by_one
+				return
+			except rospy.ROSException:
+				pass
+
+	def call_bodies_one_by_one(self, ids):
+		#same answer as mocap_get_data_batch, with one mocap_get_data request per body
+		return BodiesDataResponse(ids,[self.call_body_data(i).pos for i in ids])
 
 	def start_pub(self):
 		rospy.Subscriber("/gazebo/model_states",ModelStates,self.update_positions)
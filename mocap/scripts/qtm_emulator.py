@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+#Stand-in for the QTM real-time server, to run and load-test the mocap nodes away from the lab
+#Speaks the part of the QTM RT protocol (version 1.11) used by mocap_source.Mocap:
+#   welcome message, Version, New, TakeControl, ReleaseControl, Close
+#   GetCurrentFrame 6DEuler                 ->  one 6DOF Euler data packet with the current frame
+#   StreamFrames <rate> [UDP:port] 6DEuler  ->  frames pushed over TCP (or UDP), rate is AllFrames,
+#                                               Frequency:n or FrequencyDivisor:n
+#   StreamFrames Stop
+#The synthetic bodies fly horizontal circles around the origin (positions in mm, angles in degrees)
+#Timestamps are wall-clock microseconds, so a client on the same machine can measure its latency
+#(see mocap_benchmark.py)
+
+### To run, use for example "rosrun mocap qtm_emulator.py -p 22224 -n 10 -r 100 --jitter 0.002 --dropout 0.05 --nan 3"
+### then connect with mocap_source.Mocap(host='127.0.0.1', port=22224)
+
+import argparse
+import math
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import numpy
+from mocap_source import _read_packet, _decode_packet
+
+WELCOME='QTM RT Interface connected'
+
+#packet types
+TYPE_ERROR=0
+TYPE_COMMAND=1
+TYPE_DATA=3
+TYPE_NO_MORE_DATA=4
+
+
+def build_parser():
+	"""Creates parser for command line arguments """
+	parser = argparse.ArgumentParser(description='QTM real-time protocol emulator')
+	parser.add_argument('-p', '--port',
+	                    help='TCP port to listen on',
+	                    default=22224,
+	                    type=int)
+	parser.add_argument('-n', '--bodies',
+	                    help='Number of rigid bodies',
+	                    default=3,
+	                    type=int)
+	parser.add_argument('-r', '--rate',
+	                    help='Capture rate of the emulated cameras [Hz]',
+	                    default=100.,
+	                    type=float)
+	parser.add_argument('--jitter',
+	                    help='Standard deviation of the random delay added to every packet [s]',
+	                    default=0.,
+	                    type=float)
+	parser.add_argument('--dropout',
+	                    help='Probability that a streamed frame is never sent',
+	                    default=0.,
+	                    type=float)
+	parser.add_argument('--nan',
+	                    help='Ids of the bodies that are never visible (NaN)',
+	                    default=[],
+	                    nargs='+',
+	                    type=int)
+	parser.add_argument('--nan-probability',
+	                    help='Probability that a body is not visible in a frame',
+	                    default=0.,
+	                    dest='nan_probability',
+	                    type=float)
+	return parser
+
+
+def build_packet(packet_type,payload):
+	return struct.pack('>ll',len(payload)+8,packet_type)+payload
+
+
+def build_message(packet_type,text):
+	return build_packet(packet_type,text.encode('UTF-8')+b'\x00')
+
+
+def build_data_packet(timestamp,framenumber,bodies):
+	#one 6DOF Euler component with a (N,6) array of bodies
+	body_bytes=bodies.astype('>f4').tostring()
+	component=struct.pack('>lllhh',8+8+len(body_bytes),6,len(bodies),0,0)+body_bytes
+	return build_packet(TYPE_DATA,struct.pack('>qll',timestamp,framenumber,1)+component)
+
+
+class Scene():
+	def __init__(self,body_count,rate,nan_bodies,nan_probability):
+		self.rate=rate
+		self.nan_probability=nan_probability
+		self.start_time=time.time()
+		ids=numpy.arange(body_count)
+		self.radius=1000.+200.*ids
+		self.angular_speed=0.5+0.1*ids
+		self.phase=2*math.pi*ids/max(body_count,1)
+		self.height=1000.+100.*ids
+		self.always_nan=numpy.zeros(body_count,dtype=bool)
+		for body_id in nan_bodies:
+			if 0<body_id<=body_count:
+				self.always_nan[body_id-1]=True
+
+	def current_framenumber(self):
+		return int((time.time()-self.start_time)*self.rate)
+
+	def frame(self,framenumber):
+		#state of all the bodies at a given frame
+		t=framenumber/self.rate
+		angle=self.phase+self.angular_speed*t
+		bodies=numpy.empty((len(angle),6))
+		bodies[:,0]=self.radius*numpy.cos(angle)
+		bodies[:,1]=self.radius*numpy.sin(angle)
+		bodies[:,2]=self.height
+		bodies[:,3]=0.
+		bodies[:,4]=0.
+		bodies[:,5]=numpy.degrees(angle+math.pi/2)%360.-180.
+		hidden=self.always_nan
+		if self.nan_probability:
+			hidden=hidden|(numpy.random.random(len(angle))<self.nan_probability)
+		bodies[hidden]=float('nan')
+		return bodies
+
+	def data_packet(self,framenumber):
+		timestamp=int((self.start_time+framenumber/self.rate)*1E6)
+		return build_data_packet(timestamp,framenumber,self.frame(framenumber))
+
+
+class Server():
+	def __init__(self,scene,port,jitter,dropout):
+		self.scene=scene
+		self.port=port
+		self.jitter=jitter
+		self.dropout=dropout
+		self.master=None
+		self.lock=threading.Lock()
+
+	def delay(self):
+		if self.jitter:
+			time.sleep(abs(random.gauss(0.,self.jitter)))
+
+	def serve_forever(self):
+		listener=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		listener.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+		listener.bind(('',self.port))
+		listener.listen(5)
+		print('QTM emulator listening on port '+str(listener.getsockname()[1]))
+		while True:
+			connection,address=listener.accept()
+			client=Client(self,connection,address)
+			thread=threading.Thread(target=client.run)
+			thread.daemon=True
+			thread.start()
+
+
+class Client():
+	def __init__(self,server,connection,address):
+		self.server=server
+		self.connection=connection
+		self.address=address
+		self.send_lock=threading.Lock()
+		self.stream=None
+
+	def send(self,packet):
+		with self.send_lock:
+			self.connection.sendall(packet)
+
+	def reply(self,text,packet_type=TYPE_COMMAND):
+		self.send(build_message(packet_type,text))
+
+	def run(self):
+		print('Client connected from '+str(self.address))
+		try:
+			self.reply(WELCOME)
+			while True:
+				packet=_read_packet(self.connection)
+				if packet is None:
+					continue
+				msg=_decode_packet(*packet)
+				if msg['message'] is not None:
+					self.handle(msg['message'].rstrip('\x00').strip())
+		except socket.error:
+			print('Client '+str(self.address)+' disconnected')
+		except Exception as e:
+			print('Client '+str(self.address)+' dropped: '+str(e))
+		finally:
+			self.stop_stream()
+			with self.server.lock:
+				if self.server.master is self:
+					self.server.master=None
+			self.connection.close()
+
+	def handle(self,command):
+		words=command.split()
+		if not words:
+			return
+		keyword=words[0].lower()
+		if keyword=='version':
+			self.reply('Version set to '+(words[1] if len(words)>1 else '1.11'))
+		elif keyword=='takecontrol':
+			with self.server.lock:
+				self.server.master=self
+			self.reply('You are now master')
+		elif keyword=='releasecontrol':
+			with self.server.lock:
+				if self.server.master is self:
+					self.server.master=None
+			self.reply('You are now a regular client')
+		elif keyword=='new':
+			if self.server.master is self:
+				self.reply('Creating new connection')
+			else:
+				self.reply('You must be master to issue this command')
+		elif keyword=='close':
+			self.reply('Closing connection')
+		elif keyword=='getcurrentframe':
+			self.server.delay()
+			self.send(self.server.scene.data_packet(self.server.scene.current_framenumber()))
+		elif keyword=='streamframes':
+			self.stop_stream()
+			if len(words)>1 and words[1].lower()!='stop':
+				self.start_stream(words[1:])
+		else:
+			self.reply('Parse error',TYPE_ERROR)
+
+	def start_stream(self,options):
+		divisor=1
+		udp_port=None
+		for option in options:
+			name,_,value=option.partition(':')
+			name=name.lower()
+			if name=='frequency':
+				divisor=max(1,int(round(self.server.scene.rate/float(value))))
+			elif name=='frequencydivisor':
+				divisor=max(1,int(value))
+			elif name=='udp':
+				udp_port=int(value)
+		self.stream=Stream(self,divisor,udp_port)
+		thread=threading.Thread(target=self.stream.run)
+		thread.daemon=True
+		thread.start()
+
+	def stop_stream(self):
+		if self.stream is not None:
+			self.stream.running=False
+			self.stream=None
+
+
+class Stream():
+	def __init__(self,client,divisor,udp_port):
+		self.client=client
+		self.divisor=divisor
+		self.running=True
+		self.udp_socket=None
+		if udp_port is not None:
+			self.udp_socket=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+			self.udp_address=(client.address[0],udp_port)
+
+	def run(self):
+		server=self.client.server
+		scene=server.scene
+		framenumber=scene.current_framenumber()
+		try:
+			while self.running:
+				framenumber+=self.divisor
+				wait=scene.start_time+framenumber/scene.rate-time.time()
+				if wait>0:
+					time.sleep(wait)
+				if server.dropout and random.random()<server.dropout:
+					continue
+				server.delay()
+				packet=scene.data_packet(framenumber)
+				if self.udp_socket is None:
+					self.client.send(packet)
+				else:
+					self.udp_socket.sendto(packet,self.udp_address)
+		except Exception as e:
+			print('Stream to '+str(self.client.address)+' stopped: '+str(e))
+		finally:
+			if self.udp_socket is not None:
+				self.udp_socket.close()
+
+
+if __name__=='__main__':
+	args=build_parser().parse_args()
+	scene=Scene(args.bodies,args.rate,args.nan,args.nan_probability)
+	try:
+		Server(scene,args.port,args.jitter,args.dropout).serve_forever()
+	except KeyboardInterrupt:
+		sys.exit()
+
+#EOF
@@ -5,9 +5,10 @@ import mocap_source
 import sys
 import ast
 import sml_setup
+import state_estimator
 
-from mocap.msg import QuadPosition
 from mocap.msg import QuadPositionDerived
+from mocap.msg import QuadPositionDerivedArray
 
 import analysis
 import utils
@@ -16,49 +17,12 @@ NODE_NAME='MOCAP'
 #*****************************************
 
 
-class Time():
-	def __init__(self):
-		self.current_time=rospy.Time.now()
-		self.past_time=self.current_time
-		self.time_diff=0
-
-	def get_time_diff(self):
-		self.past_time=self.current_time
-		self.current_time=rospy.Time.now()
-		d_time=self.current_time-self.past_time
-		self.time_diff=d_time.secs+(d_time.nsecs/1E9)
-
-		return self.time_diff
-
-
-
-def Get_Body_Data(body_id):
+def Get_Bodies_Data():
+	#Request one frame from QTM and index all its bodies by id
 	bodies=Qs.get_updated_bodies()
-	body_length=len(bodies)
-	body_indice=-1
-
-	if isinstance(bodies,list):
-		for i in range(0,body_length):
-			if(bodies[i]['id']==body_id):
-				body_indice=i
-
-	data=QuadPosition()
-
-	if(body_indice==-1):
-		#utils.logerr('Body %i not found'%(body_id))
-		data.found_body=False
-		return(data)
-	
-	
-	data.found_body=True
-	data.x=bodies[body_indice]["x"]
-	data.y=bodies[body_indice]["y"]
-	data.z=bodies[body_indice]["z"]
-	data.pitch=bodies[body_indice]["pitch"]
-	data.roll=bodies[body_indice]["roll"]
-	data.yaw=bodies[body_indice]["yaw"]
-
-	return(data)
+	if not isinstance(bodies,list):
+		return {}
+	return dict((body['id'],body) for body in bodies)
 
 
 def Get_Topic_Names(bodies):
@@ -79,47 +43,17 @@ def Get_Publishers(topic_array):
 	return(result)
 
 
-def Insert_Current_Data(current_data):
-	result=QuadPositionDerived()
-	result.found_body=current_data.found_body
-	result.x=current_data.x
-	result.y=current_data.y
-	result.z=current_data.z
-	result.pitch=current_data.pitch
-	result.roll=current_data.roll
-	result.yaw=current_data.yaw
-	return(result)
-
-
-def Compute_Derivative(current,past,time):
-	if time:
-		result=(current-past)/time
-		return(result)
-	else:
-		utils.logwarn("Infinite derivative.")
-		return 0
-
-
-def Get_Derived_Data(current_data,past_data,time):
-	result=Insert_Current_Data(current_data)
-	result.x_vel=Compute_Derivative(current_data.x,past_data.x,time)
-	result.y_vel=Compute_Derivative(current_data.y,past_data.y,time)
-	result.z_vel=Compute_Derivative(current_data.z,past_data.z,time)
-	result.pitch_vel=Compute_Derivative(current_data.pitch,past_data.pitch,time)
-	result.roll_vel=Compute_Derivative(current_data.roll,past_data.roll,time)
-	result.yaw_vel=Compute_Derivative(current_data.yaw,past_data.yaw,time)
-	result.x_acc=Compute_Derivative(result.x_vel,past_data.x_vel,time)
-	result.y_acc=Compute_Derivative(result.y_vel,past_data.y_vel,time)
-	result.z_acc=Compute_Derivative(result.z_vel,past_data.z_vel,time)
-	result.pitch_acc=Compute_Derivative(result.pitch_vel,past_data.pitch_vel,time)
-	result.roll_acc=Compute_Derivative(result.roll_vel,past_data.roll_vel,time)
-	result.yaw_acc=Compute_Derivative(result.yaw_vel,past_data.yaw_vel,time)
+def Get_Array_Data(body_array,data,stamp):
+	#all the bodies of one frame in a single message
+	result=QuadPositionDerivedArray()
+	result.header.stamp=stamp
+	result.ids=body_array
+	result.bodies=data
 	return(result)
 
 
 def start_publishing():
 	rate=rospy.Rate(30)
-	timer=Time()
 	#Get parameters (all the body ID's that are requested)
 	body_array=sml_setup.Get_Parameter(NODE_NAME,'body_array',[8,16,17])
 	if type(body_array) is str:
@@ -130,6 +64,8 @@ def start_publishing():
 
 	#Establish one publisher topic for each requested body
 	topics_publisher=Get_Publishers(body_topic_array)
+	#and one for all of them
+	all_publisher=rospy.Publisher('body_data/all',QuadPositionDerivedArray,queue_size=10)
 
 	#Initialize empty past data list
 	mocap_past_data=[]
@@ -137,24 +73,39 @@ def start_publishing():
 	for i in range(0,len(body_array)):
 		mocap_past_data.append(empty_data)
 
+	#Velocities and accelerations of all the bodies, estimated from the QTM frame timestamps
+	theta=sml_setup.Get_Parameter(NODE_NAME,'estimator_theta',state_estimator.THETA)
+	estimator=state_estimator.StateEstimator(len(body_array),theta)
+	clock=state_estimator.CaptureClock()
+	last_frame_number=None
+
 	# Initialize error numbers
 	error = [0]*len(body_array)
 
 	while not rospy.is_shutdown():
 
-		delta_time=timer.get_time_diff()
+		#One snapshot for all the bodies of this tick
+		bodies=Get_Bodies_Data()
+		timestamp,frame_number=state_estimator.Get_Frame(bodies)
+		if frame_number is not None and frame_number==last_frame_number:
+			#QTM has no new frame yet, there is nothing new to publish
+			rate.sleep()
+			continue
+		last_frame_number=frame_number
+		if timestamp is not None:
+			clock.update(timestamp)
+
+		measurements,found=state_estimator.Get_Measurements(bodies,body_array)
+		estimator.update(timestamp,measurements,found,frame_number)
+		mocap_data_derived=estimator.get_messages(clock)
 
 		for i in range(0,len(body_array)):
-			mocap_data=Get_Body_Data(body_array[i])
-
-			if mocap_data.found_body:
-				mocap_data_derived=Get_Derived_Data(mocap_data,mocap_past_data[i],delta_time)
-
+			if found[i]:
 				#update past mocap data
-				mocap_past_data[i]=mocap_data_derived
+				mocap_past_data[i]=mocap_data_derived[i]
 
 				#Publish data on topic
-				topics_publisher[i].publish(mocap_data_derived)
+				topics_publisher[i].publish(mocap_data_derived[i])
 				error[i]=0
 			else:
 				error[i]+=1
@@ -168,17 +119,32 @@ def start_publishing():
 					utils.logwarn("Body %i: %i errors. Stop printing Errors!"%(body_array[i],error[i]))
 
 				topics_publisher[i].publish(mocap_past_data[i])
+
+		if timestamp is not None:
+			stamp=clock.to_ros(timestamp)
+		else:
+			stamp=rospy.Time.now()
+		all_publisher.publish(Get_Array_Data(body_array,mocap_past_data,stamp))
 		rate.sleep()
 
 
 if __name__=="__main__":
 	rospy.init_node("ros_mocap_message")
-	Qs=mocap_source.Mocap(info=0)
+	if sml_setup.Get_Parameter(NODE_NAME,'use_mocap_broker',False):
+		#share the QTM connection of mocap_broker.py instead of opening our own
+		Qs=mocap_source.BrokerClient(sml_setup.Get_Parameter(NODE_NAME,'mocap_broker_path',mocap_source.BROKER_PATH))
+	else:
+		Qs=mocap_source.Mocap(info=0)
 	bodies=Qs.get_updated_bodies()
 	if(bodies=="off"):
 		rospy.logerr("No connection to the Qualisys Motion Capture System")
 		sys.exit()
 	else:
+		#let QTM push frames instead of requesting each one
+		if sml_setup.Get_Parameter(NODE_NAME,'mocap_stream',False):
+			frequency=sml_setup.Get_Parameter(NODE_NAME,'mocap_stream_frequency',None)
+			udp_port=sml_setup.Get_Parameter(NODE_NAME,'mocap_stream_udp_port',None)
+			Qs.start_streaming(frequency,udp_port)
 		start_publishing()
 
 #EOF
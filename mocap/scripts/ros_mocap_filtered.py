@@ -5,17 +5,23 @@ import mocap
 import sys
 import ast
 import sml_setup
+import state_estimator
 import tf
 import numpy as np
 import std_msgs.msg
 
 from mocap.msg import QuadPosition
 from mocap.msg import QuadPositionDerived
+from mocap.msg import QuadPositionDerivedArray
 
 from geometry_msgs.msg import PoseWithCovarianceStamped, Pose
 
 from scipy import signal
 
+import analysis
+import loop_stats
+import quad_state
+
 #************Constants********************
 NODE_NAME='MOCAP'
 
@@ -24,48 +30,37 @@ SIZE_BUFFER=100
 T_pos=0.05
 T_vel=0.05
 T_acc=0.05
+KEYS_POS=['x','y','z','pitch','roll','yaw']
+KEYS_VEL=['x_vel','y_vel','z_vel','pitch_vel','roll_vel','yaw_vel']
+KEYS_ACC=['x_acc','y_acc','z_acc','pitch_acc','roll_acc','yaw_acc']
+#the first 18 fields of a QuadState, in the same order
+FILTER_KEYS=KEYS_POS+KEYS_VEL+KEYS_ACC
 #*****************************************
 
 
-class Time():
-	def __init__(self):
-		self.current_time=rospy.Time.now()
-		self.past_time=self.current_time
-		self.time_diff=0
-
-	def get_time_diff(self):
-		self.past_time=self.current_time
-		self.current_time=rospy.Time.now()
-		d_time=self.current_time-self.past_time
-		self.time_diff=d_time.secs+(d_time.nsecs/1E9)
-
-		return self.time_diff
-
-
-def Get_Body_Data(body_id):
+def Get_Bodies_Data():
+	#Request one frame from QTM and index all its bodies by id
 	bodies=Qs.get_updated_bodies()
-	body_length=len(bodies)
-	body_indice=-1
+	if not isinstance(bodies,list):
+		return {}
+	return dict((body['id'],body) for body in bodies)
 
-	if isinstance(bodies,list):
-		for i in range(0,body_length):
-			if(bodies[i]['id']==body_id):
-				body_indice=i
 
+def Get_Body_Data(body_id,bodies):
 	data=QuadPosition()
 
-	if(body_indice==-1):
+	if body_id not in bodies:
 		data.found_body=False
 		return(data)
-	
-	
+
+	body=bodies[body_id]
 	data.found_body=True
-	data.x=bodies[body_indice]["x"]
-	data.y=bodies[body_indice]["y"]
-	data.z=bodies[body_indice]["z"]
-	data.pitch=bodies[body_indice]["pitch"]
-	data.roll=bodies[body_indice]["roll"]
-	data.yaw=bodies[body_indice]["yaw"]
+	data.x=body["x"]
+	data.y=body["y"]
+	data.z=body["z"]
+	data.pitch=body["pitch"]
+	data.roll=body["roll"]
+	data.yaw=body["yaw"]
 
 	return(data)
 
@@ -89,100 +84,120 @@ def Get_Publishers(topic_array):
 
 
 def Insert_Current_Data(current_data,time):
-	result=QuadPositionDerived()
-	result.found_body=current_data.found_body
-	result.x=current_data.x
-	result.y=current_data.y
-	result.z=current_data.z
-	result.pitch=current_data.pitch
-	result.roll=current_data.roll
-	result.yaw=current_data.yaw
+	result=quad_state.QuadState()
+	result.update_pos(current_data)
 	result.time_diff=time
 	return(result)
 
 
-def Compute_Derivative(current,past,time):
-	result=(current-past)/time
+def Get_Derived_Data(current_data,past_data,time):
+	#velocities and accelerations of the 6 coordinates at once, 0 without time difference
+	result=Insert_Current_Data(current_data,time)
+	if time:
+		result.data[6:12]=(result.data[0:6]-past_data.data[0:6])/time
+		result.data[12:18]=(result.data[6:12]-past_data.data[6:12])/time
 	return(result)
 
 
-def Get_Derived_Data(input_signal,current_data,past_data,time):
-	result=Insert_Current_Data(current_data,time)
-	result.x_vel=Compute_Derivative(current_data.x,past_data.x,time)
-	result.y_vel=Compute_Derivative(current_data.y,past_data.y,time)
-	result.z_vel=Compute_Derivative(current_data.z,past_data.z,time)
-	result.pitch_vel=Compute_Derivative(current_data.pitch,past_data.pitch,time)
-	result.roll_vel=Compute_Derivative(current_data.roll,past_data.roll,time)
-	result.yaw_vel=Compute_Derivative(current_data.yaw,past_data.yaw,time)
-	result.x_acc=Compute_Derivative(result.x_vel,past_data.x_vel,time)
-	result.y_acc=Compute_Derivative(result.y_vel,past_data.y_vel,time)
-	result.z_acc=Compute_Derivative(result.z_vel,past_data.z_vel,time)
-	result.pitch_acc=Compute_Derivative(result.pitch_vel,past_data.pitch_vel,time)
-	result.roll_acc=Compute_Derivative(result.roll_vel,past_data.roll_vel,time)
-	result.yaw_acc=Compute_Derivative(result.yaw_vel,past_data.yaw_vel,time)
-
-	if current_data.found_body:
-		Add_Data(input_signal,result)
-	
-	result = Apply_Filter(input_signal)
-	result.found_body=current_data.found_body
+def Get_Filter_Values(data):
+	return data.data[0:len(FILTER_KEYS)]
 
-	return(result)
 
-def Add_Data(input_signal,current_data):
-	if len(input_signal)>SIZE_BUFFER:
-		input_signal.pop(0)
-
-	input_signal.append(current_data)
-
-def Apply_Filter_sig(sig,deltaT,T):
-	#N=10
-	#return np.mean(sig[len(sig)-N:len(sig)])
-	if len(sig):
-		i = 0
-		t=0.0
-		m=0.0
-		while t<T and len(sig)>=i:
-			t+=deltaT[-i]
-			m+=sig[-i]
-			i+=1
-		return m/i
-	else:
-		return 0
-
-def Get_Signal_From_Dict(data,key):
-	return [d.__getattribute__(key) for d in data]
-
-def Apply_Filter(input_signal):
-	result = QuadPositionDerived()
-	keys_pos = ['x','y','z','pitch','roll','yaw']
-	keys_vel = ['x_vel','y_vel','z_vel','pitch_vel','roll_vel','yaw_vel']
-	keys_acc = ['x_acc','y_acc','z_acc','pitch_acc','roll_acc','yaw_acc']
-	deltaT = Get_Signal_From_Dict(input_signal,'time_diff')
-	for k in keys_pos:
-		s = Get_Signal_From_Dict(input_signal,k)
-		r = Apply_Filter_sig(s,deltaT,T_pos)
-		result.__setattr__(k,r)
-	
-	for k in keys_vel:
-		s = Get_Signal_From_Dict(input_signal,k)
-		r = Apply_Filter_sig(s,deltaT,T_vel)
-		result.__setattr__(k,r)
-	
-	for k in keys_acc:
-		s = Get_Signal_From_Dict(input_signal,k)
-		r = Apply_Filter_sig(s,deltaT,T_vel)
-		result.__setattr__(k,r)
-	
+def Get_Filtered_Data(values,found_body):
+	result=quad_state.QuadState()
+	result.data[0:len(FILTER_KEYS)]=values
+	result.found_body=found_body
 	return result
 
 
+def Get_Array_Data(body_array,data,stamp):
+	#all the bodies of one frame in a single message
+	result=QuadPositionDerivedArray()
+	result.header.stamp=stamp
+	result.ids=body_array
+	result.bodies=data
+	return(result)
+
+
+class MovingAverage():
+	#Time-window moving average of the FILTER_KEYS channels of several bodies at once
+	#Each body has a ring buffer with its last SIZE_BUFFER samples (plus their time_diff), and for each
+	#channel group (position, velocity, acceleration) the running sums of the samples in its window:
+	#the window is the shortest run of newest samples spanning the group's filter time
+	#Adding a sample is O(1) per channel whatever the buffer size, and the output of all bodies is one division
+
+	def __init__(self,n_bodies,size=SIZE_BUFFER,windows=(T_pos,T_vel,T_acc)):
+		n_channels=len(FILTER_KEYS)
+		self.size=size
+		self.windows=windows
+		self.groups=[slice(0,6),slice(6,12),slice(12,18)]
+		self.channel_group=np.repeat(np.arange(len(self.groups)),6)
+		#last column holds the time_diff of the sample
+		self.buffer=np.zeros((n_bodies,size,n_channels+1))
+		self.newest=np.full(n_bodies,-1,dtype=int)
+		self.count=np.zeros(n_bodies,dtype=int)
+		self.sums=np.zeros((n_bodies,n_channels))
+		self.length=np.zeros((n_bodies,len(self.groups)),dtype=int)
+		self.duration=np.zeros((n_bodies,len(self.groups)))
+
+	def add(self,body,values,time_diff):
+		buf=self.buffer[body]
+		if self.count[body]==self.size:
+			#the oldest sample is about to be overwritten, take it out of the windows still holding it
+			for g in range(0,len(self.groups)):
+				if self.length[body,g]==self.size:
+					self.__remove_oldest(body,g)
+		else:
+			self.count[body]+=1
+
+		newest=(self.newest[body]+1)%self.size
+		self.newest[body]=newest
+		buf[newest,:-1]=values
+		buf[newest,-1]=time_diff
+		self.sums[body]+=buf[newest,:-1]
+		self.length[body]+=1
+		self.duration[body]+=time_diff
+
+		for g in range(0,len(self.groups)):
+			#drop the oldest samples as long as the window still spans the filter time without them
+			while self.length[body,g]>1 and self.duration[body,g]-buf[self.__oldest(body,g),-1]>=self.windows[g]:
+				self.__remove_oldest(body,g)
+
+		if newest==self.size-1:
+			self.__resum(body)
+
+	def filtered(self):
+		#filtered channels of all the bodies, (n_bodies,len(FILTER_KEYS)), 0 for bodies without samples
+		length=self.length[:,self.channel_group]
+		return np.where(length>0,self.sums/np.maximum(length,1),0.)
+
+	def __oldest(self,body,g):
+		return (self.newest[body]-self.length[body,g]+1)%self.size
+
+	def __remove_oldest(self,body,g):
+		sample=self.buffer[body,self.__oldest(body,g)]
+		cols=self.groups[g]
+		self.sums[body,cols]-=sample[cols]
+		self.duration[body,g]-=sample[-1]
+		self.length[body,g]-=1
+
+	def __resum(self,body):
+		#recompute the running sums once per lap of the ring buffer, so rounding errors do not pile up
+		buf=self.buffer[body]
+		for g in range(0,len(self.groups)):
+			indices=(self.newest[body]-np.arange(self.length[body,g]))%self.size
+			cols=self.groups[g]
+			self.sums[body,cols]=buf[indices,cols].sum(axis=0)
+			self.duration[body,g]=buf[indices,-1].sum()
+
+
 class GetData:
 	def __init__(self):
-		rospy.Timer(rospy.Duration(0.01), self.mocap_get_data_callback)
-
 		rate=rospy.Rate(30)
-		self.timer=Time()
+		#capture time and frame number of the last QTM frame
+		self.clock=state_estimator.CaptureClock()
+		self.timestamp=None
+		self.frame_number=None
 		#Get parameters (all the body ID's that are requested)
 		self.body_array=sml_setup.Get_Parameter(NODE_NAME,'body_array',[8,12])
 		if type(self.body_array) is str:
@@ -193,40 +208,126 @@ class GetData:
 
 		#Establish one publisher topic for each requested body
 		topics_publisher=Get_Publishers(body_topic_array)
+		#and one for all of them
+		all_publisher=rospy.Publisher('body_data/all',QuadPositionDerivedArray,queue_size=10)
 
 		#Initialize empty past data list
 		self.mocap_past_data=[]
+		self.mocap_past_states=[]
 		empty_data=QuadPositionDerived()
 		for i in range(0,len(self.body_array)):
 			self.mocap_past_data.append(empty_data)
+			self.mocap_past_states.append(quad_state.QuadState())
+		self.mocap_all_data=None
+
+		#Velocities and accelerations are estimated from the QTM frame timestamps,
+		#the legacy finite differences smoothed by a moving average are still available
+		if sml_setup.Get_Parameter(NODE_NAME,'mocap_moving_average',False):
+			self.filter=MovingAverage(len(self.body_array))
+			self.estimator=None
+		else:
+			theta=sml_setup.Get_Parameter(NODE_NAME,'estimator_theta',state_estimator.THETA)
+			self.estimator=state_estimator.StateEstimator(len(self.body_array),theta)
+			self.filter=None
+
+		#Timing of the filter and of the publishing loop, logged every loop_stats_interval seconds
+		interval=sml_setup.Get_Parameter(NODE_NAME,'loop_stats_interval',10.)
+		self.filter_stats=loop_stats.LoopStats('mocap filter',0.01,interval)
+		publish_stats=loop_stats.LoopStats('mocap publisher',1./30,interval)
+
+		#the timer only starts once everything it uses is ready
+		#it never waits for QTM: the frames are read by the reader thread of Qs, see __main__
+		rospy.Timer(rospy.Duration(0.01), self.mocap_get_data_callback)
 
-		#Initialize buffer
-		self.input_signal=[]
-		for i in range(0,len(self.body_array)):
-			self.input_signal.append([])
-
+		#every frame is published once, not again until the next one
+		published=[None]*len(self.body_array)
+		published_all=None
 		while not rospy.is_shutdown():
+			publish_stats.start()
+			mocap_data=self.mocap_past_data
 			for i in range(0,len(self.body_array)):
-				topics_publisher[i].publish(self.mocap_past_data[i])
+				if mocap_data[i] is not published[i]:
+					topics_publisher[i].publish(mocap_data[i])
+					published[i]=mocap_data[i]
+			mocap_all_data=self.mocap_all_data
+			if mocap_all_data is not published_all:
+				all_publisher.publish(mocap_all_data)
+				published_all=mocap_all_data
+			publish_stats.stop()
 			rate.sleep()
 
 	def mocap_get_data_callback(self,event):
-		delta_time=self.timer.get_time_diff()
+		self.filter_stats.start()
+		#One snapshot for all the bodies of this tick
+		bodies=Get_Bodies_Data()
+		timestamp,frame_number=state_estimator.Get_Frame(bodies)
+		#nothing to do until QTM has a new frame
+		if frame_number is None or frame_number!=self.frame_number:
+			self.frame_number=frame_number
+			if timestamp is not None:
+				self.clock.update(timestamp)
+				stamp=self.clock.to_ros(timestamp)
+			else:
+				stamp=rospy.Time.now()
+			mocap_data=self.filter_bodies(bodies,timestamp,frame_number)
+			#single assignments, the publishing loop never sees a half-updated frame
+			self.mocap_past_data=mocap_data
+			self.mocap_all_data=Get_Array_Data(self.body_array,mocap_data,stamp)
+		self.filter_stats.stop()
+
+	def filter_bodies(self,bodies,timestamp,frame_number):
+		if self.estimator is not None:
+			measurements,found=state_estimator.Get_Measurements(bodies,self.body_array)
+			self.estimator.update(timestamp,measurements,found,frame_number)
+			return self.estimator.get_messages(self.clock)
+
+		#time between the captures of this frame and of the previous one
+		delta_time=0.
+		if timestamp is not None:
+			if self.timestamp is not None:
+				delta_time=timestamp-self.timestamp
+			self.timestamp=timestamp
+
+		found_body=[]
 		for i in range(0,len(self.body_array)):
-			mocap_data=Get_Body_Data(self.body_array[i])
-			mocap_data_derived=Get_Derived_Data(self.input_signal[i],mocap_data,self.mocap_past_data[i],delta_time)
-
-			#update past mocap data
-			self.mocap_past_data[i]=mocap_data_derived
+			mocap_data=Get_Body_Data(self.body_array[i],bodies)
+			mocap_data_derived=Get_Derived_Data(mocap_data,self.mocap_past_states[i],delta_time)
+			if mocap_data.found_body and delta_time>0:
+				self.filter.add(i,Get_Filter_Values(mocap_data_derived),delta_time)
+			found_body.append(mocap_data.found_body)
+
+		#Filter all the bodies in one pass and update past mocap data
+		filtered=self.filter.filtered()
+		mocap_data=[]
+		for i in range(0,len(self.body_array)):
+			state=Get_Filtered_Data(filtered[i],found_body[i])
+			if found_body[i]:
+				state.stamp=self.clock.to_ros(timestamp)
+				state.frame_number=frame_number
+			self.mocap_past_states[i]=state
+			mocap_data.append(state.to_msg(QuadPositionDerived()))
+		return mocap_data
 
 if __name__=="__main__":
 	rospy.init_node("ros_mocap")
-	Qs=mocap.Mocap(info=0)
+	if sml_setup.Get_Parameter(NODE_NAME,'use_mocap_broker',False):
+		#share the QTM connection of mocap_broker.py instead of opening our own
+		Qs=mocap.BrokerClient(sml_setup.Get_Parameter(NODE_NAME,'mocap_broker_path',mocap.BROKER_PATH))
+	else:
+		Qs=mocap.Mocap(info=0)
 	bodies=Qs.get_updated_bodies()
 	if(bodies=="off"):
 		rospy.logerr("No connection to the Qualisys Motion Capture System")
 		sys.exit()
 	else:
+		#the frames are read by a background thread, the filter only picks the latest one
+		#QTM either pushes them (mocap_stream) or answers GetCurrentFrame requests
+		frequency=sml_setup.Get_Parameter(NODE_NAME,'mocap_stream_frequency',None)
+		if sml_setup.Get_Parameter(NODE_NAME,'mocap_stream',False):
+			udp_port=sml_setup.Get_Parameter(NODE_NAME,'mocap_stream_udp_port',None)
+			Qs.start_streaming(frequency,udp_port)
+		else:
+			Qs.start_polling(frequency)
 		GetData()
 
 #EOF
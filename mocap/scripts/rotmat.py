@@ -24,6 +24,7 @@
 '''
 
 from math import sin, cos, sqrt, asin, atan2, pi, radians, acos
+import numpy
 
 class Vector3:
     '''a vector'''
@@ -281,6 +282,269 @@ class Matrix3:
         '''the trace of the matrix'''
         return self.a.x + self.b.y + self.c.z
 
+class Vector3Array:
+    '''N vectors at once, as a (N,3) float64 array
+    the arithmetic works on all the vectors in one numpy operation,
+    indexing gives (and takes) a plain Vector3'''
+    def __init__(self, v=None, n=0):
+        if v is None:
+            self.v = numpy.zeros((n,3))
+        else:
+            self.v = numpy.array(v, dtype=float).reshape((-1,3))
+
+    @staticmethod
+    def from_list(vectors):
+        return Vector3Array([(v.x, v.y, v.z) for v in vectors])
+
+    def to_list(self):
+        return [Vector3(v) for v in self.v.tolist()]
+
+    def __repr__(self):
+        return 'Vector3Array(%s)' % repr(self.v)
+
+    def __len__(self):
+        return len(self.v)
+
+    def __getitem__(self, i):
+        return Vector3(self.v[i].tolist())
+
+    def __setitem__(self, i, v):
+        self.v[i] = (v.x, v.y, v.z)
+
+    @property
+    def x(self):
+        return self.v[:,0]
+
+    @property
+    def y(self):
+        return self.v[:,1]
+
+    @property
+    def z(self):
+        return self.v[:,2]
+
+    def __add__(self, v):
+        return Vector3Array(self.v + v.v)
+
+    __radd__ = __add__
+
+    def __sub__(self, v):
+        return Vector3Array(self.v - v.v)
+
+    def __neg__(self):
+        return Vector3Array(-self.v)
+
+    def __mul__(self, v):
+        if isinstance(v, Vector3Array):
+            '''dot products'''
+            return numpy.einsum('ij,ij->i', self.v, v.v)
+        return Vector3Array(self.v * numpy.reshape(v, (-1,1)))
+
+    __rmul__ = __mul__
+
+    def __div__(self, v):
+        return Vector3Array(self.v / numpy.reshape(v, (-1,1)))
+
+    __truediv__ = __div__
+
+    def __mod__(self, v):
+        '''cross products'''
+        return Vector3Array(numpy.cross(self.v, v.v))
+
+    def __copy__(self):
+        return Vector3Array(self.v)
+
+    copy = __copy__
+
+    def length(self):
+        return numpy.sqrt(numpy.einsum('ij,ij->i', self.v, self.v))
+
+    def normalized(self):
+        return self / self.length()
+
+    def normalize(self):
+        self.v /= self.length()[:,numpy.newaxis]
+
+class Matrix3Array:
+    '''N 3x3 matrices at once, as a (N,3,3) float64 array (rows a, b, c)
+    same methods as Matrix3, each one a single numpy operation over all the matrices,
+    indexing gives (and takes) a plain Matrix3'''
+    def __init__(self, m=None, n=0):
+        if m is None:
+            self.m = numpy.zeros((n,3,3))
+            self.identity()
+        else:
+            self.m = numpy.array(m, dtype=float).reshape((-1,3,3))
+
+    @staticmethod
+    def from_list(matrices):
+        return Matrix3Array([((m.a.x, m.a.y, m.a.z), (m.b.x, m.b.y, m.b.z), (m.c.x, m.c.y, m.c.z)) for m in matrices])
+
+    def to_list(self):
+        return [self[i] for i in range(len(self.m))]
+
+    def __repr__(self):
+        return 'Matrix3Array(%s)' % repr(self.m)
+
+    def __len__(self):
+        return len(self.m)
+
+    def __getitem__(self, i):
+        (a, b, c) = self.m[i].tolist()
+        return Matrix3(Vector3(a), Vector3(b), Vector3(c))
+
+    def __setitem__(self, i, m):
+        self.m[i] = ((m.a.x, m.a.y, m.a.z), (m.b.x, m.b.y, m.b.z), (m.c.x, m.c.y, m.c.z))
+
+    def identity(self):
+        self.m[:] = numpy.eye(3)
+
+    def transposed(self):
+        return Matrix3Array(self.m.transpose((0,2,1)))
+
+    def from_euler(self, roll, pitch, yaw):
+        '''fill the matrices from arrays of Euler angles in radians'''
+        cp = numpy.cos(pitch)
+        sp = numpy.sin(pitch)
+        sr = numpy.sin(roll)
+        cr = numpy.cos(roll)
+        sy = numpy.sin(yaw)
+        cy = numpy.cos(yaw)
+
+        m = numpy.empty((len(cp),3,3))
+        m[:,0,0] = cp * cy
+        m[:,0,1] = (sr * sp * cy) - (cr * sy)
+        m[:,0,2] = (cr * sp * cy) + (sr * sy)
+        m[:,1,0] = cp * sy
+        m[:,1,1] = (sr * sp * sy) + (cr * cy)
+        m[:,1,2] = (cr * sp * sy) - (sr * cy)
+        m[:,2,0] = -sp
+        m[:,2,1] = sr * cp
+        m[:,2,2] = cr * cp
+        self.m = m
+        return self
+
+    def to_euler(self):
+        '''find Euler angles (321 convention) for the matrices, as arrays'''
+        m = self.m
+        c_x = m[:,2,0]
+        pitch = numpy.where(c_x >= 1.0, pi,
+                numpy.where(c_x <= -1.0, -pi, -numpy.arcsin(numpy.clip(c_x, -1.0, 1.0))))
+        roll = numpy.arctan2(m[:,2,1], m[:,2,2])
+        yaw = numpy.arctan2(m[:,1,0], m[:,0,0])
+        return (roll, pitch, yaw)
+
+    def to_euler312(self):
+        '''find Euler angles (312 convention) for the matrices, as arrays'''
+        m = self.m
+        yaw = numpy.arctan2(-m[:,0,1], m[:,1,1])
+        roll = numpy.arcsin(numpy.clip(m[:,2,1], -1.0, 1.0))
+        pitch = numpy.arctan2(-m[:,2,0], m[:,2,2])
+        return (roll, pitch, yaw)
+
+    def from_euler312(self, roll, pitch, yaw):
+        '''fill the matrices from arrays of Euler angles in radians in 312 convention'''
+        c3 = numpy.cos(pitch)
+        s3 = numpy.sin(pitch)
+        s2 = numpy.sin(roll)
+        c2 = numpy.cos(roll)
+        s1 = numpy.sin(yaw)
+        c1 = numpy.cos(yaw)
+
+        m = numpy.empty((len(c3),3,3))
+        m[:,0,0] = c1 * c3 - s1 * s2 * s3
+        m[:,1,1] = c1 * c2
+        m[:,2,2] = c3 * c2
+        m[:,0,1] = -c2*s1
+        m[:,0,2] = s3*c1 + c3*s2*s1
+        m[:,1,0] = c3*s1 + s3*s2*c1
+        m[:,1,2] = s1*s3 - s2*c1*c3
+        m[:,2,0] = -s3*c2
+        m[:,2,1] = s2
+        self.m = m
+        return self
+
+    def from_quaternion(self, q):
+        '''fill the matrices from a (N,4) array of w, x, y, z quaternions'''
+        q = numpy.asarray(q, dtype=float).reshape((-1,4))
+        q1 = q[:,0]
+        q2 = q[:,1]
+        q3 = q[:,2]
+        q4 = q[:,3]
+
+        m = numpy.empty((len(q),3,3))
+        m[:,0,0] = 1.0-2.0*(q3*q3 + q4*q4)
+        m[:,0,1] =   2.0*(q2*q3 - q1*q4)
+        m[:,0,2] =   2.0*(q2*q4 + q1*q3)
+        m[:,1,0] =   2.0*(q2*q3 + q1*q4)
+        m[:,1,1] = 1.0-2.0*(q2*q2 + q4*q4)
+        m[:,1,2] =   2.0*(q3*q4 - q1*q2)
+        m[:,2,0] =   2.0*(q2*q4 - q1*q3)
+        m[:,2,1] =   2.0*(q3*q4 + q1*q2)
+        m[:,2,2] = 1.0-2.0*(q2*q2 + q3*q3)
+        self.m = m
+        return self
+
+    def to_quaternion(self):
+        '''(N,4) array of the w, x, y, z quaternions (w >= 0) of rotation matrices'''
+        m = self.m
+        m00 = m[:,0,0]
+        m11 = m[:,1,1]
+        m22 = m[:,2,2]
+        q = numpy.empty((len(m),4))
+        q[:,0] = 0.5*numpy.sqrt(numpy.maximum(0.0, 1.0 + m00 + m11 + m22))
+        q[:,1] = numpy.copysign(0.5*numpy.sqrt(numpy.maximum(0.0, 1.0 + m00 - m11 - m22)), m[:,2,1] - m[:,1,2])
+        q[:,2] = numpy.copysign(0.5*numpy.sqrt(numpy.maximum(0.0, 1.0 - m00 + m11 - m22)), m[:,0,2] - m[:,2,0])
+        q[:,3] = numpy.copysign(0.5*numpy.sqrt(numpy.maximum(0.0, 1.0 - m00 - m11 + m22)), m[:,1,0] - m[:,0,1])
+        return q
+
+    def __add__(self, m):
+        return Matrix3Array(self.m + m.m)
+
+    __radd__ = __add__
+
+    def __sub__(self, m):
+        return Matrix3Array(self.m - m.m)
+
+    def __mul__(self, other):
+        if isinstance(other, Vector3Array):
+            return Vector3Array(numpy.einsum('nij,nj->ni', self.m, other.v))
+        elif isinstance(other, Matrix3Array):
+            return Matrix3Array(numpy.einsum('nij,njk->nik', self.m, other.m))
+        return Matrix3Array(self.m * numpy.reshape(other, (-1,1,1)))
+
+    def __div__(self, v):
+        return Matrix3Array(self.m / numpy.reshape(v, (-1,1,1)))
+
+    __truediv__ = __div__
+
+    def __neg__(self):
+        return Matrix3Array(-self.m)
+
+    def __copy__(self):
+        return Matrix3Array(self.m)
+
+    copy = __copy__
+
+    def rotate(self, g):
+        '''rotate each matrix by its own (Vector3Array) amount on 3 axes'''
+        self.m += numpy.cross(self.m, g.v[:,numpy.newaxis,:])
+
+    def normalize(self):
+        '''re-normalise the rotation matrices'''
+        a = self.m[:,0]
+        b = self.m[:,1]
+        error = numpy.einsum('ij,ij->i', a, b)[:,numpy.newaxis]
+        t0 = a - b * (0.5 * error)
+        t1 = b - a * (0.5 * error)
+        t2 = numpy.cross(t0, t1)
+        for (i, t) in enumerate((t0, t1, t2)):
+            self.m[:,i] = t / numpy.sqrt(numpy.einsum('ij,ij->i', t, t))[:,numpy.newaxis]
+
+    def trace(self):
+        '''the traces of the matrices'''
+        return numpy.einsum('nii->n', self.m)
+
 def test_euler():
     '''check that from_euler() and to_euler() are consistent'''
     m = Matrix3()
@@ -333,8 +597,47 @@ def test_euler312():
             for y in range(-179, 179, 3):
                 test_euler312_single(r,p,y)
 
+def test_batch():
+    '''check that Matrix3Array and Vector3Array agree with Matrix3 and Vector3'''
+    import time
+    n = 100
+    roll = numpy.random.uniform(-pi, pi, n)
+    pitch = numpy.random.uniform(-pi/2, pi/2, n)
+    yaw = numpy.random.uniform(-pi, pi, n)
+    g = Vector3Array(numpy.random.uniform(-0.1, 0.1, (n,3)))
+    v = Vector3Array(numpy.random.uniform(-1, 1, (n,3)))
+    ms = Matrix3Array().from_euler(roll, pitch, yaw)
+    for i in range(n):
+        m = Matrix3()
+        m.from_euler(roll[i], pitch[i], yaw[i])
+        if abs(numpy.array(ms.to_euler())[:,i] - m.to_euler()).max() > 1.0e-12:
+            print('BATCH EULER ERROR:', i)
+        if abs(numpy.array(ms.to_euler312())[:,i] - m.to_euler312()).max() > 1.0e-12:
+            print('BATCH EULER312 ERROR:', i)
+        r = (m * v[i]) - (ms * v)[i]
+        if r.length() > 1.0e-12:
+            print('BATCH PRODUCT ERROR:', i)
+    q = Matrix3Array(ms.m).to_quaternion()
+    if abs(Matrix3Array().from_quaternion(q).m - ms.m).max() > 1.0e-12:
+        print('BATCH QUATERNION ERROR')
+    rotated = ms.copy()
+    rotated.rotate(g)
+    rotated.normalize()
+    for i in range(n):
+        m = ms[i]
+        m.rotate(g[i])
+        m.normalize()
+        if abs(Matrix3Array.from_list([m]).m[0] - rotated.m[i]).max() > 1.0e-12:
+            print('BATCH ROTATE ERROR:', i)
+
+    start = time.time()
+    for i in range(100):
+        Matrix3Array().from_quaternion(q).to_euler()
+    print('quaternions to Euler angles of %u bodies: %.1f us' % (n, (time.time() - start)*1.0e4))
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
     test_euler()
     test_euler312()
+    test_batch()
@@ -5,6 +5,7 @@
 #Publishes two topics read by RVIZ: one for the position and orientation of the quad (rviz/quad_position) and for for the path (rviz/quad_trajectory)
 #This node is called with an argument (ID of the body to draw)
 #If there is no available body with that ID, the node is shut down
+#The trajectory only holds the last poses of the body (see analysis/scripts/path_buffer.py)
 
 import sys
 import rospy
@@ -14,6 +15,8 @@ from nav_msgs.msg import Path
 from geometry_msgs.msg import PoseStamped
 from mocap.srv import BodyData
 from mocap .msg import QuadPosition
+import analysis
+import path_buffer
 
 
 def draw_body_found(body):
@@ -92,24 +95,19 @@ def talk(body_id):
 		sys.exit()
 	rospy.loginfo('[RVIZ] Connection established')
 
-	path=Path()
-	path.header.stamp=rospy.get_rostime()
-	path.header.frame_id='map'
+	#size and resolution of the drawn trajectory
+	path=path_buffer.PathBuffer(trajectory,'map',
+		int(rospy.get_param('/rviz_mocap/path_capacity',1000)),
+		rospy.get_param('/rviz_mocap/path_min_distance',0.02),
+		max_rate=rospy.get_param('/rviz_mocap/path_max_rate',10.),
+		segments=rospy.get_param('/rviz_mocap/path_segments',False))
 
-	posestamped=PoseStamped()
-	posestamped.header.stamp=rospy.get_rostime()
-	posestamped.header.frame_id='map'
-	posestamped.pose.position.x=0.0
-	posestamped.pose.position.y=0.0
-	posestamped.pose.position.z=0.0
-
-	list_posestamped=[posestamped]
-	del list_posestamped[0]
+	#one connection for all the requests
+	body_info=rospy.ServiceProxy('mocap_get_data',BodyData,persistent=True)
 
 	while not rospy.is_shutdown():
 		#try to contact the mocap service, exit the program if there is no connection
 		try:
-			body_info=rospy.ServiceProxy('mocap_get_data',BodyData)
 			body=body_info(body_id)
 		except:
 			rospy.logerr('[RVIZ] No connection to the mocap system')
@@ -120,22 +118,21 @@ def talk(body_id):
 			data_to_rviz=draw_body_found(body)
 			#add the current point to the trajectory line
 			current_point=PoseStamped()
+			current_point.header=data_to_rviz.header
 			current_point.pose.position.x=data_to_rviz.pose.position.x
 			current_point.pose.position.y=data_to_rviz.pose.position.y
 			current_point.pose.position.z=data_to_rviz.pose.position.z
-			list_posestamped.append(current_point)
+			path.add(current_point)
 		else:
 			rospy.logerr('[RVIZ] The requested body is not available')
 			data_to_rviz=draw_body_error(body)
 
 
 		#publish the data to rviz
-		path.poses=list_posestamped
-
 		#position and orientation of the quad
 		position.publish(data_to_rviz)
-		#trajectory of the quad
-		trajectory.publish(path)
+		#trajectory of the quad, when it has changed
+		path.publish()
 		
 		loop_rate.sleep()
 
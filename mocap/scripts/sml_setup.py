@@ -86,8 +86,9 @@ def Set_System_ID(NODE_NAME,id_int):
 
 
 
-def Connect_To_Mocap(NODE_NAME):
+def Connect_To_Mocap(NODE_NAME,persistent=False):
 	#Connect to the Motion Capture System, flag an error if it is unavailable
+	#A persistent proxy keeps its connection open between calls, for nodes calling it in a loop
 
 	try:
 		utils.loginfo('Connecting to the mocap system...')
@@ -97,7 +98,7 @@ def Connect_To_Mocap(NODE_NAME):
 		sys.exit()
 	utils.loginfo('Connected to Mocap')
 
-	return rospy.ServiceProxy('mocap_get_data',BodyData)
+	return rospy.ServiceProxy('mocap_get_data',BodyData,persistent=persistent)
 
 
 
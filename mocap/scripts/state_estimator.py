@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+#Constant-acceleration alpha-beta-gamma estimator of the pose of several bodies at once
+#The position, velocity and acceleration of x,y,z,pitch,roll,yaw of the N tracked bodies are (N,6) arrays,
+#so a new measurement of all the bodies is a single vectorized predict/correct step
+#The time steps are the differences between the capture timestamps of the measurements (QTM frame
+#timestamps), not the wall clock of the node, so a late or skipped tick does not distort the derivatives
+#The published messages carry the capture time (mapped onto ROS time) and the frame number of their measurement
+
+import rospy
+import numpy as np
+
+from mocap.msg import QuadPositionDerived
+
+#************Constants********************
+KEYS_POS=['x','y','z','pitch','roll','yaw']
+KEYS_VEL=['x_vel','y_vel','z_vel','pitch_vel','roll_vel','yaw_vel']
+KEYS_ACC=['x_acc','y_acc','z_acc','pitch_acc','roll_acc','yaw_acc']
+#pitch, roll and yaw are in degrees and wrap around at +-180
+ANGLES=np.array([False,False,False,True,True,True])
+
+#Memory of the filter: 0 follows the measurements, close to 1 smooths more (and lags more)
+THETA=0.5
+#A body lost for longer than this [s] is tracked again from scratch
+MAX_GAP=0.5
+#*****************************************
+
+
+def Wrap_Angles(angles):
+	return (angles+180.)%360.-180.
+
+
+def Get_Gains(theta):
+	#gains of the critically damped (fading memory) alpha-beta-gamma filter
+	alpha=1.-theta**3
+	beta=1.5*(1.-theta)**2*(1.+theta)
+	gamma=0.5*(1.-theta)**3
+	return alpha,beta,gamma
+
+
+class StateEstimator():
+	def __init__(self,n_bodies,theta=THETA,max_gap=MAX_GAP):
+		self.alpha,self.beta,self.gamma=Get_Gains(theta)
+		self.max_gap=max_gap
+		self.pos=np.zeros((n_bodies,6))
+		self.vel=np.zeros((n_bodies,6))
+		self.acc=np.zeros((n_bodies,6))
+		self.time=np.zeros(n_bodies)
+		self.time_diff=np.zeros(n_bodies)
+		self.frame_number=np.zeros(n_bodies,dtype=int)
+		self.tracked=np.zeros(n_bodies,dtype=bool)
+		self.found=np.zeros(n_bodies,dtype=bool)
+
+	def update(self,timestamp,measurements,found,frame_number=0):
+		#timestamp: capture time of the measurements [s], None if there is no frame
+		#measurements: (N,6) x,y,z,pitch,roll,yaw of all the bodies, found: (N,) which of them were seen
+		measurements=np.asarray(measurements,dtype=float)
+		found=np.asarray(found,dtype=bool)&~np.isnan(measurements).any(axis=1)
+		if timestamp is None:
+			found[:]=False
+			timestamp=0.
+		dt=timestamp-self.time
+
+		#first sighting, reacquisition after a long gap or a restarted clock: start again from the measurement
+		restart=found&(~self.tracked|(dt<0)|(dt>self.max_gap))
+		#a repeated frame (dt==0) brings no new information
+		correct=found&~restart&(dt>0)
+
+		if correct.any():
+			d=dt[correct][:,np.newaxis]
+			pos=self.pos[correct]
+			vel=self.vel[correct]
+			acc=self.acc[correct]
+
+			#predict
+			pos=pos+vel*d+0.5*acc*d*d
+			vel=vel+acc*d
+
+			#correct
+			residual=measurements[correct]-pos
+			residual[:,ANGLES]=Wrap_Angles(residual[:,ANGLES])
+			pos=pos+self.alpha*residual
+			pos[:,ANGLES]=Wrap_Angles(pos[:,ANGLES])
+			self.pos[correct]=pos
+			self.vel[correct]=vel+(self.beta/d)*residual
+			self.acc[correct]=acc+(2.*self.gamma/(d*d))*residual
+			self.time_diff[correct]=dt[correct]
+			self.time[correct]=timestamp
+			self.frame_number[correct]=frame_number
+
+		if restart.any():
+			self.pos[restart]=measurements[restart]
+			self.vel[restart]=0.
+			self.acc[restart]=0.
+			self.time_diff[restart]=0.
+			self.time[restart]=timestamp
+			self.frame_number[restart]=frame_number
+			self.tracked[restart]=True
+
+		self.found=found
+
+	def get_messages(self,clock=None):
+		#estimate of all the bodies as QuadPositionDerived messages, stamped with the capture time of their
+		#last measurement through clock (a CaptureClock), or as is when the timestamps already are ROS times
+		state=np.hstack((self.pos,self.vel,self.acc)).tolist()
+		time_diff=self.time_diff.tolist()
+		result=[]
+		for i in range(0,len(state)):
+			data=QuadPositionDerived()
+			if clock is None:
+				data.header.stamp=rospy.Time.from_sec(self.time[i])
+			else:
+				data.header.stamp=clock.to_ros(self.time[i])
+			data.frame_number=int(self.frame_number[i])
+			data.found_body=bool(self.found[i])
+			(data.x,data.y,data.z,data.pitch,data.roll,data.yaw,
+			 data.x_vel,data.y_vel,data.z_vel,data.pitch_vel,data.roll_vel,data.yaw_vel,
+			 data.x_acc,data.y_acc,data.z_acc,data.pitch_acc,data.roll_acc,data.yaw_acc)=state[i]
+			data.time_diff=time_diff[i]
+			result.append(data)
+		return result
+
+
+def Get_Measurements(bodies,body_array):
+	#(N,6) measurements and (N,) found flags of the requested bodies, from a dict of mocap_source pose dicts
+	measurements=np.zeros((len(body_array),6))
+	found=np.zeros(len(body_array),dtype=bool)
+	for i in range(0,len(body_array)):
+		if body_array[i] in bodies:
+			body=bodies[body_array[i]]
+			measurements[i]=[body[key] for key in KEYS_POS]
+			found[i]=True
+	return measurements,found
+
+
+def Get_Frame(bodies):
+	#QTM capture time [s] and frame number of a frame, None and None without any body
+	for body in bodies.values():
+		return body['ts']/1E6,body['frame']
+	return None,None
+
+
+class CaptureClock():
+	#Maps capture timestamps [s] of another clock (QTM counts from the start of the measurement) onto ROS time
+	#The offset between the two clocks is taken at the first frame, and again whenever the capture clock restarts
+
+	def __init__(self):
+		self.offset=None
+		self.last=None
+
+	def update(self,timestamp):
+		if self.offset is None or timestamp<self.last:
+			self.offset=rospy.get_time()-timestamp
+		self.last=timestamp
+
+	def to_ros(self,timestamp):
+		if self.offset is None:
+			return rospy.Time()
+		return rospy.Time.from_sec(timestamp+self.offset)
+
+#EOF